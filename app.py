@@ -1,4 +1,6 @@
+from core.metrics import setup_logging
 from core.watermark_app import WatermarkApplication
 
 if __name__ == '__main__':
+    setup_logging()
     wp = WatermarkApplication()
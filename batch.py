@@ -0,0 +1,105 @@
+import argparse
+import json
+
+from config import config
+from core.batch_pipeline import BatchPipeline
+from core.batch_processor import BatchProcessor
+from core.blend_backends import BLENDERS
+from core.metrics import metrics, setup_logging
+from core.watermark_renderer import WatermarkRenderer
+from core.watermark_spec import WatermarkSpec
+from utils import parse_color
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Watermark a directory or glob of images without the GUI.")
+    parser.add_argument("input", help="Input directory or glob pattern, e.g. 'photos/**/*.jpg'")
+    parser.add_argument("-o", "--output", required=True, help="Output directory")
+    parser.add_argument("--spec", help="Watermark spec JSON (e.g. saved from the GUI); overrides the text options")
+    parser.add_argument("--text", default=config.DEFAULT_WATERMARK)
+    parser.add_argument("--font", default=config.DEFAULT_FONT)
+    parser.add_argument("--font-size", type=int, default=config.DEFAULT_FONT_SIZE,
+                        help="Font size at preview resolution, scaled to each image like the GUI export")
+    parser.add_argument("--font-style", default=config.DEFAULT_FONT_STYLE,
+                        choices=["normal", "bold", "italic", "bold italic"])
+    parser.add_argument("--font-weight", type=int, help="Weight axis value (100-900), overrides the style's weight")
+    parser.add_argument("--font-width", type=int, help="Width axis value in percent, for fonts with a width axis")
+    parser.add_argument("--color", type=parse_color, default=config.DEFAULT_FONT_COLOR_RGB, help="R,G,B")
+    parser.add_argument("--opacity", type=int, default=config.DEFAULT_OPACITY, help="0-255")
+    parser.add_argument("--position", default=config.WATERMARK_POSITION,
+                        choices=[*WatermarkRenderer.positions, WatermarkRenderer.pattern],
+                        help="Corner/center anchor, or 'tile' to repeat the text across the whole image")
+    parser.add_argument("--margin", type=int, default=config.WATERMARK_MARGIN)
+    parser.add_argument("--angle", type=float, help="Text rotation in degrees (defaults to [PATTERN] ANGLE for tile)")
+    parser.add_argument("--spacing", type=int, default=config.PATTERN_SPACING,
+                        help="Gap between tiled copies at preview resolution")
+    parser.add_argument("--format", default=config.OUTPUT_FORMAT, type=str.upper, choices=["PNG", "JPEG", "WEBP"],
+                        help="Output format; encoder settings come from [ENCODER] in config.ini")
+    parser.add_argument("--backend", default=config.BLEND_BACKEND, choices=list(BLENDERS),
+                        help="Blend backend for compositing (numpy requires NumPy)")
+    parser.add_argument("--workers", type=int, default=config.BATCH_WORKERS, help="Worker processes")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap reading, rendering and writing with bounded queues and report per-stage stats")
+    parser.add_argument("--reader-threads", type=int, default=config.PIPELINE_READER_THREADS)
+    parser.add_argument("--writer-threads", type=int, default=config.PIPELINE_WRITER_THREADS)
+    parser.add_argument("--queue-size", type=int, default=config.PIPELINE_QUEUE_SIZE)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Re-render every input even if its output is up to date in the output cache")
+    parser.add_argument("--jpeg-patch", action="store_true",
+                        help="JPEG to JPEG: re-encode only the blocks under the watermark (needs jpegtran with -drop, "
+                             "else re-encodes with the source's own quantization tables)")
+    parser.add_argument("--metrics", help="Write timing spans and counters, summed over all workers, to this file")
+    parser.add_argument("--metrics-format", default="json", choices=["json", "prometheus"])
+    parser.add_argument("--profile", default=config.PROFILE_DIR or None,
+                        help="Directory for a cProfile .prof file per job (off by default)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    setup_logging()
+    if args.metrics:
+        metrics.enabled = True
+
+    angle = args.angle
+    if angle is None:
+        angle = config.PATTERN_ANGLE if args.position == WatermarkRenderer.pattern else 0
+
+    options = {
+        "text": args.text,
+        "color": (*args.color[:3], args.opacity),
+        "font_name": args.font,
+        "font_size": args.font_size,
+        "font_style": args.font_style,
+        "font_weight": args.font_weight,
+        "font_width": args.font_width,
+        "position": args.position,
+        "margin": args.margin,
+        "rotation": angle,
+        "spacing": args.spacing,
+    }
+    if args.spec:
+        options = WatermarkSpec.load(args.spec)
+
+    kwargs = {"workers": args.workers, "fmt": args.format, "blend_backend": args.backend, "profile_dir": args.profile,
+              "use_cache": False if args.no_cache else None, "jpeg_patch": args.jpeg_patch or None}
+    if args.pipeline:
+        processor = BatchPipeline(options, args.output, reader_threads=args.reader_threads,
+                                  writer_threads=args.writer_threads, queue_size=args.queue_size, **kwargs)
+    else:
+        processor = BatchProcessor(options, args.output, **kwargs)
+    summary = processor.run(args.input)
+
+    print(f"Watermarked {summary['processed']} images into {args.output}")
+    if summary["skipped"]:
+        print(f"Skipped {summary['skipped']} unchanged images")
+    for input_path, error in summary["failed"]:
+        print(f"Failed {input_path}: {error}")
+    if args.pipeline:
+        print(json.dumps({key: summary[key] for key in ("wall_seconds", "stages", "queues")}, indent=2))
+    if args.metrics:
+        print(f"Metrics written to {metrics.dump(args.metrics, args.metrics_format)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Micro-benchmark the Pillow and NumPy blend backends on the same tile and report their largest pixel difference.
+
+    python benchmarks/bench_blend_backends.py --tile 1200x300
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageChops  # noqa: E402
+
+from config import config  # noqa: E402
+from core.blend_backends import BLENDERS  # noqa: E402
+from core.watermark_renderer import WatermarkRenderer  # noqa: E402
+
+
+def make_tile(renderer, size, opacity):
+    font = renderer.fonts_manager.get_font(config.DEFAULT_FONT, size[1], "bold")
+    tile, _ = renderer.get_text_tile(config.DEFAULT_WATERMARK, font, (240, 240, 240, opacity))
+    return tile.resize(size)
+
+
+def run_backend(name, base, tile, opacity, repeat):
+    renderer = WatermarkRenderer(blend_backend=name)
+    prepared = renderer.blender.prepare_tile(tile)
+    position = (base.width // 4, base.height // 4)
+
+    image = base.copy()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        renderer.composite_tile(image, prepared, position, opacity)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    result = renderer.composite_tile(base.copy(), prepared, position, opacity)
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", default="4000x3000")
+    parser.add_argument("--tile", default="1200x300")
+    parser.add_argument("--opacity", type=int, default=180)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    image_size = tuple(map(int, args.image.split("x")))
+    tile_size = tuple(map(int, args.tile.split("x")))
+    renderer = WatermarkRenderer()
+    tile = make_tile(renderer, tile_size, 200)
+
+    gradient = Image.linear_gradient("L").resize(image_size)
+    translucent = gradient.convert("RGBA")
+    # Alpha runs from transparent to opaque across the image, so the tile lands on partially transparent pixels
+    translucent.putalpha(gradient.transpose(Image.Transpose.ROTATE_90).resize(image_size))
+    bases = {"RGB": gradient.convert("RGB"), "RGBA": gradient.convert("RGBA"), "RGBA translucent": translucent}
+
+    # Text tiles are straight RGBA; cached logos come premultiplied, which each backend has to straighten alike
+    tiles = {"text": tile, "logo": tile.convert("RGBa")}
+
+    for (mode, base), (kind, sample) in itertools.product(bases.items(), tiles.items()):
+        results = {}
+        for name in BLENDERS:
+            try:
+                results[name] = run_backend(name, base, sample, args.opacity, args.repeat)
+            except ImportError as e:
+                print(json.dumps({"mode": mode, "tile": kind, "backend": name, "skipped": str(e)}))
+
+        for name, (elapsed, _) in results.items():
+            print(json.dumps({"mode": mode, "tile": kind, "backend": name, "ms": round(elapsed * 1000, 3)}))
+
+        if len(results) == 2:
+            diff = ImageChops.difference(results["pillow"][1], results["numpy"][1])
+            max_diff = max(high for _, high in diff.getextrema())
+            print(json.dumps({"mode": mode, "tile": kind, "max_channel_diff": max_diff}))
+
+if __name__ == '__main__':
+    main()
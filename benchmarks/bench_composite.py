@@ -0,0 +1,72 @@
+"""Compare the full-canvas overlay composite against the text-tile composite.
+
+Each method runs in a fresh interpreter so peak RSS is attributable to it alone:
+
+    python benchmarks/bench_composite.py --size 8000x6000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from config import config  # noqa: E402
+from core.watermark_renderer import WatermarkRenderer  # noqa: E402
+
+
+def legacy_composite(renderer, image, position, text, font, color):
+    watermark = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(watermark)
+    draw.text(position, text, font=font, fill=color, anchor=config.TEXT_ANCHOR)
+    return Image.alpha_composite(image, watermark)
+
+
+def tile_composite(renderer, image, position, text, font, color):
+    return renderer.draw_text(image, position, text, font, color)
+
+
+METHODS = {"legacy": legacy_composite, "tile": tile_composite}
+
+
+def run_method(method, size, repeat):
+    renderer = WatermarkRenderer()
+    font = renderer.fonts_manager.get_font(config.DEFAULT_FONT, 96)
+    image = Image.new("RGBA", size, (90, 120, 150, 255))
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        METHODS[method](renderer, image, (size[0] // 3, size[1] // 2), config.DEFAULT_WATERMARK, font,
+                        (255, 255, 255, 128))
+    elapsed = (time.perf_counter() - start) / repeat
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"method": method, "seconds": round(elapsed, 5), "extra_peak_rss_kb": peak_rss - baseline_rss}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="8000x6000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--method", choices=METHODS)
+    args = parser.parse_args()
+    size = tuple(map(int, args.size.split("x")))
+
+    if args.method:
+        print(json.dumps(run_method(args.method, size, args.repeat)))
+        return
+
+    for method in METHODS:
+        output = subprocess.run([sys.executable, __file__, "--size", args.size, "--repeat", str(args.repeat),
+                                 "--method", method], check=True, capture_output=True, text=True).stdout
+        print(output.strip())
+
+
+if __name__ == '__main__':
+    main()
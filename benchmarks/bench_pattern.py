@@ -0,0 +1,73 @@
+"""Compare the tiled pattern (text rasterized and rotated once, then stamped) against drawing every copy.
+
+    python benchmarks/bench_pattern.py --size 6000x4000 --font-size 48 --spacing 40
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageChops  # noqa: E402
+
+from config import config  # noqa: E402
+from core.watermark_renderer import WatermarkRenderer  # noqa: E402
+
+
+def naive_pattern(renderer, image, options):
+    # One draw.text and rotate per copy into a full-frame overlay, as a per-instance implementation would
+    font = renderer.get_font(options)
+    tile, offset = renderer.rotate_tile(*renderer.get_text_tile(options["text"], font, options["color"]),
+                                        options["rotation"])
+    positions = renderer.get_tile_positions(image.size, options, tile, offset)
+
+    overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    for position in positions:
+        copy, _ = renderer.rotate_tile(*renderer.get_text_tile(options["text"], font, options["color"]),
+                                       options["rotation"])
+        overlay.alpha_composite(copy, (max(0, position[0]), max(0, position[1])),
+                                (max(0, -position[0]), max(0, -position[1])))
+    return Image.alpha_composite(image.convert("RGBA"), overlay).convert(image.mode), len(positions)
+
+
+def tiled_pattern(renderer, image, options):
+    stamp = renderer.get_stamp(options)
+    renderer.stamps.clear()
+    return stamp.apply(image.copy()), len(stamp.get_positions(image.size))
+
+
+METHODS = {"naive": naive_pattern, "tiled": tiled_pattern}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="6000x4000")
+    parser.add_argument("--font-size", type=int, default=48)
+    parser.add_argument("--spacing", type=int, default=config.PATTERN_SPACING)
+    parser.add_argument("--angle", type=float, default=config.PATTERN_ANGLE)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    size = tuple(map(int, args.size.split("x")))
+    renderer = WatermarkRenderer()
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    options = {"text": config.DEFAULT_WATERMARK, "font_name": config.DEFAULT_FONT, "font_size": args.font_size,
+               "font_style": "bold", "color": (255, 255, 255, 96), "x": 0, "y": 0,
+               "position": WatermarkRenderer.pattern, "rotation": args.angle, "spacing": args.spacing}
+
+    results = {}
+    for name, method in METHODS.items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            results[name], copies = method(renderer, image, options)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(json.dumps({"method": name, "copies": copies, "ms": round(elapsed * 1000, 1)}))
+
+    diff = ImageChops.difference(results["naive"], results["tiled"])
+    print(json.dumps({"max_channel_diff": max(high for _, high in diff.getextrema())}))
+
+
+if __name__ == '__main__':
+    main()
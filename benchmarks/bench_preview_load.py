@@ -0,0 +1,79 @@
+"""Compare full-decode-then-thumbnail preview loading against the reduced-decode ImageLoader path.
+
+Each method runs in a fresh interpreter against the same synthetic JPEG so peak RSS is attributable to it:
+
+    python benchmarks/bench_preview_load.py --size 7300x5480
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from config import config  # noqa: E402
+from core.image_loader import ImageLoader  # noqa: E402
+
+
+def legacy_preview(path):
+    original = Image.open(path)
+    preview = original.copy()
+    preview.thumbnail(config.THUMBNAIL_SIZE)
+    return preview
+
+
+def loader_preview(path):
+    return ImageLoader().load_preview(path, config.THUMBNAIL_SIZE)
+
+
+METHODS = {"legacy": legacy_preview, "loader": loader_preview}
+
+
+def write_synthetic_jpeg(path, size):
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 12)
+    Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(path, quality=90)
+
+
+def run_method(method, path, repeat):
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for _ in range(repeat):
+        preview = METHODS[method](path)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"method": method, "seconds": round(elapsed, 4), "extra_peak_rss_kb": peak_rss - baseline_rss,
+            "preview_size": list(preview.size)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="7300x5480", help="Default is about 40 MP")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--run", nargs=2, metavar=("METHOD", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_method(args.run[0], args.run[1], args.repeat)))
+        return
+
+    size = tuple(map(int, args.size.split("x")))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "synthetic.jpg")
+        write_synthetic_jpeg(path, size)
+
+        for method in METHODS:
+            output = subprocess.run([sys.executable, __file__, "--repeat", str(args.repeat), "--run", method, path],
+                                    check=True, capture_output=True, text=True).stdout
+            print(output.strip())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Loopback load test of the HTTP render service: latency percentiles for concurrent renders of one image.
+
+By default a server is started in this process on a free port; --url targets one that is already running.
+
+    python benchmarks/bench_server.py --megapixels 12 --requests 200 --concurrency 8 -o server.json
+    python benchmarks/bench_server.py --compare server.json --threshold 0.15
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_suite import SPEC_LAYERS, get_size, write_synthetic_image  # noqa: E402
+
+from config import config  # noqa: E402
+
+
+def percentile(samples, fraction):
+    # Nearest-rank percentile, so p99 of 200 samples is the 198th fastest
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def start_local_server(workers, fmt):
+    from core.metrics import metrics
+    from core.render_server import RenderServer
+    from core.watermark_spec import WatermarkSpec
+
+    metrics.enabled = True
+    server = RenderServer(("127.0.0.1", 0), spec=WatermarkSpec(SPEC_LAYERS), fmt=fmt, workers=workers)
+    server.warm_up()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def run_client(url, path, body, headers, count, latencies, statuses, lock):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if response.will_close:
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            status = "error"
+            connection.close()
+        seconds = time.perf_counter() - start
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(seconds)
+    connection.close()
+
+
+def run_clients(url, path, body, headers, requests, concurrency, latencies, statuses, lock):
+    # Requests are split evenly over the client threads, each on its own keep-alive connection
+    counts = [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+    threads = [threading.Thread(target=run_client, args=(url, path, body, headers, count, latencies, statuses, lock))
+               for count in counts if count]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_load(url, body, requests, concurrency, spec_json, fmt):
+    path = f"/render?format={fmt}"
+    headers = {"Content-Type": "image/jpeg", "X-Watermark-Spec": spec_json}
+    latencies, statuses, lock = [], {}, threading.Lock()
+
+    # One warm-up request per client so first-render stamp and layout caching is not measured
+    run_clients(url, path, body, headers, concurrency, concurrency, [], {}, lock)
+
+    start = time.perf_counter()
+    run_clients(url, path, body, headers, requests, concurrency, latencies, statuses, lock)
+    wall_seconds = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "wall_seconds": round(wall_seconds, 3),
+        "requests_per_second": round(len(latencies) / wall_seconds, 2),
+        "latency_ms": {name: round(value * 1000, 1) for name, value in (
+            ("mean", statistics.fmean(latencies) if latencies else 0.0),
+            ("p50", percentile(latencies, 0.50) if latencies else 0.0),
+            ("p90", percentile(latencies, 0.90) if latencies else 0.0),
+            ("p99", percentile(latencies, 0.99) if latencies else 0.0),
+            ("max", max(latencies, default=0.0)))},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="Running server to test, e.g. http://127.0.0.1:8080 (default: start one)")
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--format", default="JPEG", type=str.upper, choices=["PNG", "JPEG", "WEBP"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=config.SERVER_WORKERS, help="Workers of the local server")
+    parser.add_argument("-o", "--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run; exits 1 if p99 regressed")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed p99 slowdown, as a fraction")
+    args = parser.parse_args()
+
+    size = get_size(args.megapixels)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "upload.jpg")
+        write_synthetic_image(path, size)
+        with open(path, "rb") as fp:
+            body = fp.read()
+
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_local_server(args.workers, args.format)
+
+    spec_json = json.dumps({"version": 1, "layers": SPEC_LAYERS})
+    try:
+        results = {"megapixels": args.megapixels, "size": list(size), "upload_bytes": len(body), "format": args.format,
+                   **run_load(url, body, args.requests, args.concurrency, spec_json, args.format)}
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    print(f"p50 {results['latency_ms']['p50']} ms, p99 {results['latency_ms']['p99']} ms, "
+          f"{results['requests_per_second']} req/s", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["latency_ms"]["p99"]
+        results["baseline_p99_ms"] = baseline
+        results["regressed"] = results["latency_ms"]["p99"] > baseline * (1 + args.threshold)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if results.get("regressed"):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
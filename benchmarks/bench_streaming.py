@@ -0,0 +1,86 @@
+"""Check that streaming mode keeps peak RSS under the configured memory ceiling.
+
+Writes a synthetic PPM strip by strip (so the generator itself stays small), then watermarks it in a
+fresh interpreter and compares that process's peak RSS with [STREAMING] MEMORY_LIMIT_MB:
+
+    python benchmarks/bench_streaming.py --size 20000x20000
+
+Exits with status 1 when the ceiling is exceeded.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from config import config  # noqa: E402
+from core.image_loader import ImageLoader  # noqa: E402
+from core.strip_watermarker import StripWatermarker  # noqa: E402
+from core.watermark_renderer import WatermarkRenderer  # noqa: E402
+
+OPTIONS = {
+    "text": config.DEFAULT_WATERMARK,
+    "color": (255, 255, 255, 160),
+    "font_name": config.DEFAULT_FONT,
+    "font_size": config.DEFAULT_FONT_SIZE,
+    "font_style": config.DEFAULT_FONT_STYLE,
+    "position": "center",
+    "margin": config.WATERMARK_MARGIN,
+}
+
+
+def write_synthetic_ppm(path, size, strip_height=256):
+    with open(path, "wb") as fp:
+        fp.write(b"P6\n%d %d\n255\n" % size)
+        for top in range(0, size[1], strip_height):
+            height = min(strip_height, size[1] - top)
+            shade = top * 255 // size[1]
+            fp.write(Image.new("RGB", (size[0], height), (shade, 96, 255 - shade)).tobytes())
+
+
+def run_stream(input_path, output_path, memory_limit_mb):
+    streamer = StripWatermarker(WatermarkRenderer(), ImageLoader(memory_limit_mb=memory_limit_mb))
+    start = time.perf_counter()
+    streamer.render_file(input_path, output_path, OPTIONS)
+    elapsed = time.perf_counter() - start
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"seconds": round(elapsed, 2), "peak_rss_mb": round(peak_rss_mb, 1), "memory_limit_mb": memory_limit_mb}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="20000x20000")
+    parser.add_argument("--memory-limit", type=int, default=config.STREAM_MEMORY_LIMIT_MB, help="MB")
+    parser.add_argument("--output", default=".png", choices=[".png", ".ppm"])
+    parser.add_argument("--run", nargs=2, metavar=("INPUT", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_stream(*args.run, args.memory_limit)))
+        return
+
+    size = tuple(map(int, args.size.split("x")))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "synthetic.ppm")
+        output_path = os.path.join(tmp_dir, f"watermarked{args.output}")
+        write_synthetic_ppm(input_path, size)
+
+        output = subprocess.run([sys.executable, __file__, "--memory-limit", str(args.memory_limit),
+                                 "--run", input_path, output_path], check=True, capture_output=True, text=True)
+        result = json.loads(output.stdout)
+
+    result["size"] = args.size
+    print(json.dumps(result))
+    sys.exit(0 if result["peak_rss_mb"] <= result["memory_limit_mb"] else 1)
+
+
+if __name__ == '__main__':
+    main()
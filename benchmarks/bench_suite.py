@@ -0,0 +1,223 @@
+"""Headless benchmark of the preview and export hot paths on synthetic images, emitted as JSON.
+
+Every (size, format) case runs in a fresh interpreter, so the font load is cold and peak RSS belongs to that case.
+Phases are timed and memory-profiled separately: font load, preview load, preview render (full and one drag
+update), full-resolution decode, composite and encode.
+
+    python benchmarks/bench_suite.py --sizes 1,10,100 --formats jpeg,png,tiff -o results.json
+    python benchmarks/bench_suite.py --compare results.json --threshold 0.15
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from config import config  # noqa: E402
+
+EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "tiff": ".tif", "webp": ".webp", "bmp": ".bmp"}
+
+# Watermark used for every case: an anchored mark plus a tiled pattern, so both placement paths are exercised
+SPEC_LAYERS = [
+    {"type": "text", "text": config.DEFAULT_WATERMARK, "font_name": config.DEFAULT_FONT, "font_size": 0.06,
+     "font_style": "bold", "color": [255, 255, 255, 160], "position": "bottom-right", "margin": 0.02},
+    {"type": "text", "text": "CONFIDENTIAL", "font_name": config.DEFAULT_FONT, "font_size": 0.025,
+     "color": [255, 255, 255, 60], "position": "tile", "rotation": config.PATTERN_ANGLE, "spacing": 0.04},
+]
+
+
+def get_size(megapixels):
+    # 3:2 frame with the requested pixel count
+    width = round((megapixels * 1_000_000 * 1.5) ** 0.5)
+    return width, round(width / 1.5)
+
+
+def write_synthetic_image(path, size):
+    # Gradient plus noise compresses like a photo rather than like a flat fill
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 12)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    image.save(path, **({"quality": 90} if path.endswith((".jpg", ".webp")) else {}))
+
+
+def get_rss_mb():
+    with open("/proc/self/statm") as fp:
+        return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def get_peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = {}
+
+    def measure(self, name, func, *args):
+        rss_before, peak_before = get_rss_mb(), get_peak_rss_mb()
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        self.phases[name] = {
+            "seconds": round(seconds, 4),
+            "rss_delta_mb": round(get_rss_mb() - rss_before, 1),
+            "peak_growth_mb": round(get_peak_rss_mb() - peak_before, 1),
+            "peak_rss_mb": round(get_peak_rss_mb(), 1),
+        }
+        return result
+
+
+def run_case(path, fmt):
+    # Imported in the child only, so the parent that generates images never loads the rendering stack
+    from core.fonts_manager import FontsManager
+    from core.image_loader import ImageLoader
+    from core.layer_compositor import LayerCompositor
+    from core.layers import TextLayer
+    from core.watermark_renderer import WatermarkRenderer
+    from core.watermark_spec import WatermarkSpec
+
+    timer = PhaseTimer()
+    spec = WatermarkSpec(SPEC_LAYERS)
+
+    def load_fonts():
+        fonts_manager = FontsManager()
+        for layer in SPEC_LAYERS:
+            fonts_manager.get_font(layer["font_name"], config.DEFAULT_FONT_SIZE, layer.get("font_style", "normal"))
+        return fonts_manager
+
+    renderer = WatermarkRenderer(timer.measure("font_load", load_fonts))
+    loader = ImageLoader()
+    preview = timer.measure("preview_load", loader.load_preview, path, config.THUMBNAIL_SIZE)
+
+    # Preview rendering is the GUI's compositor without the Tk blit
+    layers = [TextLayer.from_options(layer) for layer in SPEC_LAYERS]
+    compositor = LayerCompositor(renderer)
+    compositor.set_base(preview, "RGBA")
+    timer.measure("preview_render", compositor.render, layers)
+    layers[0].update(position=None, x=0.3, y=0.4)
+    timer.measure("preview_update", compositor.render, layers)
+
+    def decode():
+        image = loader.open(path)
+        image.load()
+        return image
+
+    image = timer.measure("decode", decode)
+    watermarked = timer.measure("composite", renderer.render, image, spec, None, True)
+    encoded = timer.measure("encode", renderer.encoder.encode, watermarked, fmt.upper())
+
+    return {"phases": timer.phases, "encoded_bytes": len(encoded)}
+
+
+def run_isolated(path, fmt):
+    output = subprocess.run([sys.executable, __file__, "--run", path, fmt], check=True, capture_output=True,
+                            text=True).stdout
+    return json.loads(output)
+
+
+def summarize(runs):
+    # Median seconds across repeats; memory is the worst run
+    phases = {}
+    for name in runs[0]["phases"]:
+        samples = [run["phases"][name] for run in runs]
+        phases[name] = {
+            "seconds": round(statistics.median(sample["seconds"] for sample in samples), 4),
+            "rss_delta_mb": max(sample["rss_delta_mb"] for sample in samples),
+            "peak_growth_mb": max(sample["peak_growth_mb"] for sample in samples),
+            "peak_rss_mb": max(sample["peak_rss_mb"] for sample in samples),
+        }
+    return {"phases": phases, "encoded_bytes": runs[-1]["encoded_bytes"], "repeats": len(runs)}
+
+
+def compare(results, baseline, threshold):
+    # Only timings are compared; a phase regresses when it is slower than the baseline by more than threshold
+    previous = {(case["megapixels"], case["format"]): case for case in baseline["results"]}
+    regressions = []
+    for case in results["results"]:
+        old = previous.get((case["megapixels"], case["format"]))
+        if old is None:
+            continue
+        for name, phase in case["phases"].items():
+            old_seconds = old["phases"].get(name, {}).get("seconds")
+            if not old_seconds:
+                continue
+            # Sub-5 ms differences are timer noise, whatever the ratio
+            if phase["seconds"] - old_seconds > 0.005 and phase["seconds"] > old_seconds * (1 + threshold):
+                regressions.append({"megapixels": case["megapixels"], "format": case["format"], "phase": name,
+                                    "baseline_seconds": old_seconds, "seconds": phase["seconds"],
+                                    "ratio": round(phase["seconds"] / old_seconds, 2)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1,10,100", help="Comma-separated megapixel counts")
+    parser.add_argument("--formats", default="jpeg,png,tiff", help=f"Any of {', '.join(EXTENSIONS)}")
+    parser.add_argument("--repeat", type=int, default=1, help="Fresh-process runs per case; the median is kept")
+    parser.add_argument("-o", "--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run; exits 1 on a timing regression")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed slowdown per phase, as a fraction")
+    parser.add_argument("--cache-dir", help="Keep generated images here between runs")
+    parser.add_argument("--run", nargs=2, metavar=("PATH", "FORMAT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_case(*args.run)))
+        return
+
+    formats = [fmt.strip().lower() for fmt in args.formats.split(",")]
+    unknown = [fmt for fmt in formats if fmt not in EXTENSIONS]
+    if unknown:
+        parser.error(f"Unsupported format(s): {', '.join(unknown)}")
+
+    results = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "pillow": PIL.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count(),
+                 "blend_backend": config.BLEND_BACKEND, "thumbnail_size": list(config.THUMBNAIL_SIZE)},
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_dir = args.cache_dir or tmp_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        for megapixels in (float(value) for value in args.sizes.split(",")):
+            size = get_size(megapixels)
+            for fmt in formats:
+                path = os.path.join(cache_dir, f"synthetic_{size[0]}x{size[1]}{EXTENSIONS[fmt]}")
+                if not os.path.exists(path):
+                    write_synthetic_image(path, size)
+
+                runs = [run_isolated(path, fmt) for _ in range(args.repeat)]
+                case = {"megapixels": megapixels, "size": list(size), "format": fmt,
+                        "file_bytes": os.path.getsize(path), **summarize(runs)}
+                results["results"].append(case)
+                print(f"{megapixels:g} MP {fmt}: " + ", ".join(
+                    f"{name} {phase['seconds']}s" for name, phase in case["phases"].items()), file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            results["regressions"] = compare(results, json.load(fp), args.threshold)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -38,6 +38,41 @@ class Config:
         self.IMAGE_FORMATS = tuple(self.get_config("IMAGE_PROCESSING", "IMAGE_FORMATS").split(", "))
         self.THUMBNAIL_SIZE = tuple(map(int, self.get_config("IMAGE_PROCESSING", "THUMBNAIL_SIZE").split(", ")))
 
+        # Preview
+        self.PREVIEW_FRAME_INTERVAL_MS = int(self.get_config("PREVIEW", "FRAME_INTERVAL_MS", 16))
+        self.PREVIEW_REDUCING_GAP = float(self.get_config("PREVIEW", "REDUCING_GAP", 2.0))
+        self.PREVIEW_TILE_SIZE = int(self.get_config("PREVIEW", "TILE_SIZE", 256))
+        self.PREVIEW_TILE_CACHE_SIZE = int(self.get_config("PREVIEW", "TILE_CACHE_SIZE", 256))
+        self.PREVIEW_LEVEL_CACHE_SIZE = int(self.get_config("PREVIEW", "LEVEL_CACHE_SIZE", 2))
+
+        # Streaming
+        self.STREAM_MEMORY_LIMIT_MB = int(self.get_config("STREAMING", "MEMORY_LIMIT_MB", 256))
+
+        # Rendering
+        self.BLEND_BACKEND = self.get_config("RENDERING", "BLEND_BACKEND", "pillow")
+
+        # Watermark Stamps
+        self.STAMP_CACHE_SIZE = int(self.get_config("STAMPS", "STAMP_CACHE_SIZE", 8))
+        self.STAMP_CACHE_MB = int(self.get_config("STAMPS", "STAMP_CACHE_MB", 64))
+        self.LOGO_CACHE_MB = int(self.get_config("STAMPS", "LOGO_CACHE_MB", 64))
+        self.LAYOUT_CACHE_SIZE = int(self.get_config("STAMPS", "LAYOUT_CACHE_SIZE", 64))
+
+        # Output Encoding
+        self.OUTPUT_FORMAT = self.get_config("ENCODER", "OUTPUT_FORMAT", "PNG")
+        self.JPEG_QUALITY = int(self.get_config("ENCODER", "JPEG_QUALITY", 90))
+        self.JPEG_SUBSAMPLING = self.get_config("ENCODER", "JPEG_SUBSAMPLING", "4:2:0")
+        self.JPEG_PROGRESSIVE = self.get_config_bool("ENCODER", "JPEG_PROGRESSIVE", False)
+        self.JPEG_OPTIMIZE = self.get_config_bool("ENCODER", "JPEG_OPTIMIZE", False)
+        self.PNG_COMPRESS_LEVEL = int(self.get_config("ENCODER", "PNG_COMPRESS_LEVEL", 3))
+        self.PNG_OPTIMIZE = self.get_config_bool("ENCODER", "PNG_OPTIMIZE", False)
+        self.WEBP_LOSSLESS = self.get_config_bool("ENCODER", "WEBP_LOSSLESS", False)
+        self.WEBP_QUALITY = int(self.get_config("ENCODER", "WEBP_QUALITY", 90))
+        self.WEBP_METHOD = int(self.get_config("ENCODER", "WEBP_METHOD", 4))
+        self.PRESERVE_METADATA = self.get_config_bool("ENCODER", "PRESERVE_METADATA", True)
+        self.JPEG_PATCH = self.get_config_bool("ENCODER", "JPEG_PATCH", False)
+        self.JPEG_PATCH_MAX_AREA = float(self.get_config("ENCODER", "JPEG_PATCH_MAX_AREA", 0.5))
+        self.JPEGTRAN = self.get_config("ENCODER", "JPEGTRAN", "jpegtran")
+
         # Defaults
         self.DEFAULT_FONT = self.get_config("DEFAULTS", "DEFAULT_FONT")
         self.DEFAULT_FONT_SIZE = int(self.get_config("DEFAULTS", "DEFAULT_FONT_SIZE"))
@@ -47,13 +82,53 @@ class Config:
         self.DEFAULT_WATERMARK = self.get_config("DEFAULTS", "DEFAULT_WATERMARK")
         self.DEFAULT_OPACITY = int(self.get_config("DEFAULTS", "DEFAULT_OPACITY"))
 
+        # Fonts
+        self.FONT_INDEX_FILE = os.path.join(self.BASE_DIR, self.get_config("FONTS", "FONT_INDEX_FILE",
+                                                                           "assets/fonts/font_index.json"))
+        self.FONT_CACHE_SIZE = int(self.get_config("FONTS", "FONT_CACHE_SIZE", 128))
+        self.WARM_FONT_CACHE = self.get_config_bool("FONTS", "WARM_FONT_CACHE", True)
+
         # Text Settings
         self.INITIAL_POSITION = tuple(map(int, self.get_config("TEXT", "INITIAL_POSITION").split(", ")))
         self.TEXT_ANCHOR = self.get_config("TEXT", "TEXT_ANCHOR")
 
+        # Batch Processing
+        self.BATCH_WORKERS = int(self.get_config("BATCH", "WORKERS", 0)) or os.cpu_count()
+        self.BATCH_CHUNK_SIZE = int(self.get_config("BATCH", "CHUNK_SIZE", 4))
+        self.WATERMARK_POSITION = self.get_config("BATCH", "WATERMARK_POSITION", "bottom-right")
+        self.WATERMARK_MARGIN = int(self.get_config("BATCH", "WATERMARK_MARGIN", 10))
+        self.OUTPUT_CACHE = self.get_config_bool("BATCH", "OUTPUT_CACHE", True)
+        self.OUTPUT_CACHE_FILE = self.get_config("BATCH", "OUTPUT_CACHE_FILE", ".watermark-cache.sqlite")
+
+        # Tiled Pattern
+        self.PATTERN_SPACING = int(self.get_config("PATTERN", "SPACING", 60))
+        self.PATTERN_ANGLE = float(self.get_config("PATTERN", "ANGLE", 30))
+
+        # Batch Pipeline
+        self.PIPELINE_READER_THREADS = int(self.get_config("PIPELINE", "READER_THREADS", 4))
+        self.PIPELINE_WRITER_THREADS = int(self.get_config("PIPELINE", "WRITER_THREADS", 2))
+        self.PIPELINE_QUEUE_SIZE = int(self.get_config("PIPELINE", "QUEUE_SIZE", 16))
+        self.PIPELINE_SAMPLE_INTERVAL = float(self.get_config("PIPELINE", "SAMPLE_INTERVAL", 0.1))
+
+        # Watch Folder
+        self.WATCH_SETTLE_SECONDS = float(self.get_config("WATCH", "SETTLE_SECONDS", 0.3))
+        self.WATCH_POLL_INTERVAL = float(self.get_config("WATCH", "POLL_INTERVAL", 0.25))
+        self.WATCH_QUEUE_FILE = self.get_config("WATCH", "QUEUE_FILE", ".watch-queue.sqlite")
+
+        # Render Server
+        self.SERVER_HOST = self.get_config("SERVER", "HOST", "127.0.0.1")
+        self.SERVER_PORT = int(self.get_config("SERVER", "PORT", 8080))
+        self.SERVER_WORKERS = int(self.get_config("SERVER", "WORKERS", 0)) or os.cpu_count()
+        # Requests rendering or waiting for a worker at once; 0 means two per worker
+        self.SERVER_MAX_CONCURRENT = int(self.get_config("SERVER", "MAX_CONCURRENT", 0)) or self.SERVER_WORKERS * 2
+        self.SERVER_QUEUE_TIMEOUT = float(self.get_config("SERVER", "QUEUE_TIMEOUT", 10))
+        self.SERVER_MAX_UPLOAD_MB = int(self.get_config("SERVER", "MAX_UPLOAD_MB", 200))
+
         # Logging (Uses Environment Variables)
         self.LOG_FILE = os.getenv("LOG_FILE", os.path.join(self.BASE_DIR, self.get_config("LOGGING", "LOG_FILE")))
         self.LOG_LEVEL = os.getenv("LOG_LEVEL", self.get_config("LOGGING", "LOG_LEVEL"))
+        self.METRICS_ENABLED = self.get_config_bool("LOGGING", "METRICS_ENABLED", False)
+        self.PROFILE_DIR = self.get_config("LOGGING", "PROFILE_DIR", "")
 
     def get_config(self, section, key, default=None):
         """Helper function to get a config value with a fallback."""
@@ -62,6 +137,11 @@ class Config:
         except (configparser.NoSectionError, configparser.NoOptionError):
             return default
 
+    def get_config_bool(self, section, key, default=False):
+        """Helper function to get a boolean config value with a fallback."""
+        value = self.get_config(section, key)
+        return default if value is None else value.strip().lower() in ("1", "true", "yes", "on")
+
     def get_image_path(self, image_name):
         """Get full path of an image file."""
         return os.path.join(self.IMAGE_DIR, image_name)
@@ -0,0 +1,252 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from config import config
+from core.batch_processor import BatchProcessor, _render_bytes, _warm_up
+from core.image_loader import ImageLoader
+from core.metrics import metrics
+from core.strip_watermarker import StripWatermarker
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input; each consumer thread receives one
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, size=0):
+        with self.lock:
+            self.items += 1
+            self.bytes += size
+            self.busy_seconds += seconds
+
+    def report(self, wall_seconds):
+        return {
+            "items": self.items,
+            "bytes": self.bytes,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": round(self.items / wall_seconds, 2) if wall_seconds else 0.0,
+        }
+
+
+class QueueMonitor(threading.Thread):
+    def __init__(self, queues, interval=config.PIPELINE_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.queues = queues
+        self.interval = interval
+        self.samples = {name: [] for name in queues}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for name, q in self.queues.items():
+                self.samples[name].append(q.qsize())
+
+    def report(self):
+        return {name: {"max_depth": max(samples, default=0),
+                       "avg_depth": round(sum(samples) / len(samples), 2) if samples else 0.0,
+                       "capacity": self.queues[name].maxsize}
+                for name, samples in self.samples.items()}
+
+
+class BatchPipeline(BatchProcessor):
+    def __init__(self, options, output_dir, reader_threads=None, writer_threads=None, queue_size=None, **kwargs):
+        super().__init__(options, output_dir, **kwargs)
+        self.reader_threads = reader_threads or config.PIPELINE_READER_THREADS
+        self.writer_threads = writer_threads or config.PIPELINE_WRITER_THREADS
+        self.queue_size = queue_size or config.PIPELINE_QUEUE_SIZE
+        self.loader = ImageLoader()
+
+        self.stats = {name: StageStats(name) for name in ("read", "render", "write")}
+        self.failed = []
+        self.results_lock = threading.Lock()
+        self.unchanged = 0
+
+    def fail(self, input_path, error):
+        logger.warning("Failed %s: %s", input_path, error)
+        with self.results_lock:
+            self.failed.append((input_path, error))
+
+    def read_stage(self, jobs, read_queue):
+        while True:
+            try:
+                input_path, output_path = jobs.get_nowait()
+            except queue.Empty:
+                break
+
+            start = time.perf_counter()
+            try:
+                # Huge strip-readable sources are streamed by the render stage straight from disk
+                streamed = os.path.splitext(output_path)[1].lower() in StripWatermarker.writers \
+                    and self.loader.is_streamable(input_path)
+                data = None if streamed else self.read_file(input_path)
+                if self.cache is not None and output_path not in self.entries:
+                    # Planning left new and changed inputs unread; they are hashed here from the bytes just read
+                    input_hash = None if data is None else self.cache.hash_bytes(data)
+                    fresh, self.entries[output_path] = self.cache.check(input_path, output_path, input_hash)
+                    if fresh:
+                        with self.results_lock:
+                            self.unchanged += 1
+                        continue
+            except OSError as e:
+                self.fail(input_path, str(e))
+                continue
+
+            self.stats["read"].record(time.perf_counter() - start, len(data or b""))
+            metrics.count("bytes_read", len(data or b""))
+            read_queue.put((input_path, data, output_path))
+
+    def read_file(self, path):
+        with open(path, "rb") as fp:
+            return fp.read()
+
+    def render_stage(self, executor, read_queue, write_queue, readers_left):
+        # Two tasks per worker keeps every process busy without decoded images piling up in the pool
+        in_flight = {}
+        max_in_flight = self.workers * 2
+        suspects = deque()
+        replacement = None
+
+        try:
+            while readers_left or in_flight or suspects:
+                if suspects:
+                    # Jobs that were on a broken pool run alone, so the one that breaks it again is known
+                    if not in_flight:
+                        job = suspects.popleft()
+                        in_flight[executor.submit(_render_bytes, job)] = job
+                while readers_left and not suspects and len(in_flight) < max_in_flight:
+                    try:
+                        job = read_queue.get(timeout=0.05 if in_flight else None)
+                    except queue.Empty:
+                        break
+                    if job is _DONE:
+                        readers_left -= 1
+                        continue
+                    in_flight[executor.submit(_render_bytes, job)] = job
+
+                if not in_flight:
+                    continue
+
+                done, _ = wait(in_flight, timeout=0.05, return_when=FIRST_COMPLETED)
+                lost = []
+                for future in done:
+                    job = in_flight.pop(future)
+                    try:
+                        input_path, output_path, encoded, error, seconds, data = future.result()
+                    except BrokenProcessPool:
+                        lost.append(job)
+                        continue
+                    self.collect_metrics(data)
+                    if error:
+                        self.fail(input_path, error)
+                        continue
+
+                    self.stats["render"].record(seconds, len(encoded or b""))
+                    if encoded is None:
+                        self.stats["write"].record(0.0)
+                        self.record_output(output_path)
+                    else:
+                        # Blocks when writers fall behind, which in turn stops new submissions
+                        write_queue.put((output_path, encoded))
+
+                if lost:
+                    self.requeue_lost(lost + list(in_flight.values()), suspects, self.fail)
+                    in_flight = {}
+                    if replacement is not None:
+                        replacement.shutdown(wait=False)
+                    # Reader and writer threads are running now, so the new workers are started by a fork server
+                    # instead of forking this process
+                    executor = replacement = self.start_executor(multiprocessing.get_context("forkserver"))
+        finally:
+            if replacement is not None:
+                replacement.shutdown()
+
+        for _ in range(self.writer_threads):
+            write_queue.put(_DONE)
+
+    def write_stage(self, write_queue):
+        while True:
+            item = write_queue.get()
+            if item is _DONE:
+                return
+
+            output_path, encoded = item
+            start = time.perf_counter()
+            tmp_path = f"{output_path}.tmp"
+            try:
+                with open(tmp_path, "wb") as fp:
+                    fp.write(encoded)
+                os.replace(tmp_path, output_path)
+            except OSError as e:
+                self.fail(output_path, str(e))
+                continue
+            self.stats["write"].record(time.perf_counter() - start, len(encoded))
+            metrics.count("bytes_written", len(encoded))
+            self.record_output(output_path)
+
+    def run(self, source):
+        inputs = self.collect_inputs(source)
+        if not inputs:
+            raise FileNotFoundError(f"No images found for '{source}'.")
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        pending, skipped = self.plan_jobs(inputs, stat_only=True)
+        jobs = queue.Queue()
+        for job in pending:
+            jobs.put(job)
+
+        read_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        monitor = QueueMonitor({"read": read_queue, "write": write_queue})
+
+        def read_worker():
+            self.read_stage(jobs, read_queue)
+            read_queue.put(_DONE)
+
+        start = time.perf_counter()
+        with self.start_executor() as executor:
+            # Workers are forked before the monitor, reader and writer threads exist, so none inherits a lock
+            # that one of them held at the moment of the fork
+            wait([executor.submit(_warm_up) for _ in range(self.workers)])
+            monitor.start()
+            threads = [threading.Thread(target=read_worker, daemon=True) for _ in range(self.reader_threads)]
+            threads += [threading.Thread(target=self.write_stage, args=(write_queue,), daemon=True)
+                        for _ in range(self.writer_threads)]
+            for thread in threads:
+                thread.start()
+
+            try:
+                self.render_stage(executor, read_queue, write_queue, self.reader_threads)
+                for thread in threads:
+                    thread.join()
+            finally:
+                self.close_cache()
+
+        wall_seconds = time.perf_counter() - start
+        monitor.stopped.set()
+        skipped += self.unchanged
+        logger.info("Pipeline watermarked %d of %d images in %.3f s, %d unchanged", self.stats["write"].items,
+                    len(pending), wall_seconds, skipped)
+
+        return {
+            "processed": self.stats["write"].items,
+            "skipped": skipped,
+            "failed": self.failed,
+            "wall_seconds": round(wall_seconds, 3),
+            "stages": {name: stats.report(wall_seconds) for name, stats in self.stats.items()},
+            "queues": monitor.report(),
+        }
@@ -0,0 +1,296 @@
+import glob
+import io
+import logging
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from PIL import Image, UnidentifiedImageError
+
+from config import config
+from core.image_encoder import ImageEncoder
+from core.jpeg_patcher import JpegPatcher
+from core.logo_cache import LogoCache
+from core.metrics import metrics, profiled
+from core.output_cache import OutputCache
+from core.strip_watermarker import StripWatermarker
+from core.watermark_renderer import WatermarkRenderer
+from core.watermark_spec import WatermarkSpec
+
+logger = logging.getLogger(__name__)
+
+# Per-process state, populated once by the pool initializer so fonts are parsed once per worker
+_renderer = None
+_streamer = None
+_patcher = None
+_options = None
+_profile_dir = None
+
+
+def _init_worker(options, blend_backend, metrics_enabled=False, profile_dir=None, jpeg_patch=False):
+    global _renderer, _streamer, _patcher, _options, _profile_dir
+    # Forked workers inherit the parent's counters; start from zero so merged totals are not doubled
+    metrics.snapshot(reset=True)
+    metrics.enabled = metrics_enabled
+    _renderer = WatermarkRenderer(blend_backend=blend_backend)
+    _streamer = StripWatermarker(_renderer)
+    _patcher = JpegPatcher(_renderer) if jpeg_patch else None
+    _options = options
+    _profile_dir = profile_dir
+
+
+def _drain_metrics():
+    # Each result carries the worker's metrics since its previous job, so the parent can sum them
+    return metrics.snapshot(reset=True) if metrics.enabled else None
+
+
+def _describe_error(error):
+    # MemoryError and some decoder errors carry no message
+    return str(error) or type(error).__name__
+
+
+def _watermark_file(job):
+    input_path, output_path = job
+    try:
+        with profiled(_profile_dir, Path(input_path).stem):
+            if _streamer.can_stream(input_path, output_path):
+                _streamer.render_file(input_path, output_path, _options)
+            elif _patcher is not None and _patcher.can_patch(input_path, output_path):
+                _patcher.render_file(input_path, output_path, _options)
+            else:
+                _renderer.render_file(input_path, output_path, _options)
+    except Exception as e:
+        # Any failure (decompression bomb, corrupt data, out of memory) fails this input only, not the batch
+        return input_path, _describe_error(e), _drain_metrics()
+    return input_path, None, _drain_metrics()
+
+
+def _watermark_files(jobs):
+    # One task per chunk of jobs, so small images do not each pay a round trip to the pool
+    return [_watermark_file(job) for job in jobs]
+
+
+def _render_bytes(job):
+    # Pipeline variant: the source arrives already read and the encoded result goes back to a writer thread
+    input_path, data, output_path = job
+    start = time.perf_counter()
+    try:
+        with profiled(_profile_dir, Path(input_path).stem):
+            if data is None:
+                _streamer.render_file(input_path, output_path, _options)
+                return input_path, output_path, None, None, time.perf_counter() - start, _drain_metrics()
+
+            with Image.open(io.BytesIO(data)) as image:
+                fmt = _renderer.encoder.get_format(output_path)
+                # Lossless block copies need the file (jpegtran); from memory, patch mode keeps the source's tables
+                save_options = None
+                if _patcher is not None and _patcher.is_patchable(image, fmt):
+                    save_options = _renderer.encoder.get_keep_options(image)
+                _renderer.decode(image)
+                watermarked = _renderer.render(image, _options, in_place=True)
+                encoded = _renderer.encoder.encode(watermarked, fmt, save_options)
+    except UnidentifiedImageError:
+        # Pillow names the in-memory buffer it was given, not the file the bytes came from
+        error = f"cannot identify image file '{input_path}'"
+        return input_path, output_path, None, error, time.perf_counter() - start, _drain_metrics()
+    except Exception as e:
+        return input_path, output_path, None, _describe_error(e), time.perf_counter() - start, _drain_metrics()
+    return input_path, output_path, encoded, None, time.perf_counter() - start, _drain_metrics()
+
+
+def _warm_up():
+    # Submitted once per worker at startup so processes (and their fonts) exist before the first request
+    return os.getpid()
+
+
+def _render_upload(data, spec_json, fmt):
+    # Server variant: the spec comes with each request; stamps stay cached in the worker across requests
+    try:
+        spec = WatermarkSpec.from_json(spec_json)
+        with Image.open(io.BytesIO(data)) as image:
+            _renderer.decode(image)
+            watermarked = _renderer.render(image, spec, in_place=True)
+            encoded = _renderer.encoder.encode(watermarked, fmt)
+    except Exception as e:
+        return None, _describe_error(e), _drain_metrics()
+    return encoded, None, _drain_metrics()
+
+
+class BatchProcessor:
+    def __init__(self, options, output_dir, workers=None, chunk_size=None, fmt=None, blend_backend=None,
+                 profile_dir=None, use_cache=None, jpeg_patch=None):
+        self.options = options
+        self.blend_backend = blend_backend or config.BLEND_BACKEND
+        self.output_dir = Path(output_dir)
+        self.encoder = ImageEncoder()
+        self.fmt = self.encoder.get_format("", fmt)
+        self.extension = self.encoder.get_extension(self.fmt)
+        self.workers = workers or config.BATCH_WORKERS
+        self.chunk_size = chunk_size or config.BATCH_CHUNK_SIZE
+        self.profile_dir = profile_dir or config.PROFILE_DIR or None
+        self.use_cache = config.OUTPUT_CACHE if use_cache is None else use_cache
+        self.jpeg_patch = config.JPEG_PATCH if jpeg_patch is None else jpeg_patch
+        self.cache = None
+        self.entries = {}
+        self.input_root = None
+        self.stems = Counter()
+
+    def get_worker_args(self):
+        return self.options, self.blend_backend, metrics.enabled, self.profile_dir, self.jpeg_patch
+
+    def start_executor(self, mp_context=None):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=self.get_worker_args(),
+                                   mp_context=mp_context)
+
+    def requeue_lost(self, lost, suspects, fail):
+        # A worker that dies abruptly (e.g. killed for memory) breaks the pool and every job on it. A job that was
+        # alone on the pool caused it and fails; otherwise all of them are retried one at a time to find out which
+        if len(lost) == 1:
+            fail(lost[0][0], "The worker rendering this image crashed.")
+        else:
+            logger.error("Worker pool broke with %d jobs on it, retrying them one at a time", len(lost))
+            suspects.extend(lost)
+
+    def collect_metrics(self, data):
+        if data:
+            metrics.merge(data)
+
+    def collect_inputs(self, source):
+        if os.path.isdir(source):
+            paths = (os.path.join(source, name) for name in os.listdir(source))
+        else:
+            paths = glob.glob(source, recursive=True)
+
+        return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(config.IMAGE_FORMATS))
+
+    def set_inputs(self, inputs):
+        # Outputs mirror the input directories below their common root; inputs that share a stem there (a.jpg next
+        # to a.png) are named after their full file name instead, so no two inputs write the same output
+        self.input_root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in inputs])
+        self.stems = Counter(self.get_stem_key(path) for path in inputs)
+
+    def get_stem_key(self, input_path):
+        input_path = os.path.abspath(input_path)
+        relative = os.path.relpath(input_path, self.input_root or os.path.dirname(input_path))
+        return os.path.join(os.path.dirname(relative), Path(relative).stem)
+
+    def is_ambiguous(self, input_path):
+        return self.stems[self.get_stem_key(input_path)] > 1
+
+    def get_output_path(self, input_path):
+        key = self.get_stem_key(input_path)
+        name = f"{key}.{Path(input_path).suffix.lstrip('.')}" if self.is_ambiguous(input_path) else key
+        return str(self.output_dir / f"{name}{self.extension}")
+
+    def open_cache(self):
+        if not self.use_cache:
+            return None
+        logos = [LogoCache.get_path(layer["source"]) for layer in getattr(self.options, "layers", ())
+                 if layer.get("type") == "image"]
+        save_options = dict(self.encoder.get_save_options(self.fmt), metadata=self.encoder.preserve_metadata,
+                            jpeg_patch=self.jpeg_patch)
+        render_key = OutputCache.get_render_key(WatermarkRenderer.get_options_key(self.options), self.fmt,
+                                                save_options, self.blend_backend, logos)
+        return OutputCache(self.output_dir, render_key)
+
+    def plan_jobs(self, inputs, stat_only=False):
+        # Splits inputs into jobs to render and the number whose cached output is still valid; with stat_only, new
+        # and changed inputs are left for the caller to hash (see OutputCache.check)
+        self.set_inputs(inputs)
+        jobs = [(path, self.get_output_path(path)) for path in inputs]
+        for directory in {os.path.dirname(output_path) for _, output_path in jobs}:
+            os.makedirs(directory, exist_ok=True)
+        self.cache = self.open_cache()
+        if self.cache is None:
+            return jobs, 0
+
+        def check(job):
+            try:
+                return self.cache.check(*job, stat_only=stat_only)
+            except OSError:
+                return False, None
+
+        # Stat calls, reads and hashing all release the GIL, so the checks run on threads rather than one file at a
+        # time; the threads are gone again before the process pool forks
+        pending = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for (input_path, output_path), (fresh, entry) in zip(jobs, pool.map(check, jobs)):
+                if entry is not None:
+                    self.entries[output_path] = entry
+                if not fresh:
+                    pending.append((input_path, output_path))
+        self.cache.flush()
+        return pending, len(jobs) - len(pending)
+
+    def record_output(self, output_path):
+        entry = self.entries.pop(output_path, None)
+        if self.cache is not None and entry is not None:
+            self.cache.record(output_path, entry)
+
+    def close_cache(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        self.entries = {}
+
+    def run(self, source):
+        inputs = self.collect_inputs(source)
+        if not inputs:
+            raise FileNotFoundError(f"No images found for '{source}'.")
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        jobs, skipped = self.plan_jobs(inputs)
+        try:
+            failed = self.render_jobs(jobs)
+        finally:
+            self.close_cache()
+
+        logger.info("Watermarked %d of %d images into %s, %d unchanged", len(jobs) - len(failed), len(jobs),
+                    self.output_dir, skipped)
+        return {"processed": len(jobs) - len(failed), "skipped": skipped, "failed": failed}
+
+    def render_jobs(self, jobs):
+        failed = []
+        chunks = deque(jobs[start:start + self.chunk_size] for start in range(0, len(jobs), self.chunk_size))
+        suspects = deque()
+
+        def fail(input_path, error):
+            logger.warning("Failed %s: %s", input_path, error)
+            failed.append((input_path, error))
+
+        while chunks or suspects:
+            with self.start_executor() as executor:
+                in_flight = {}
+                lost = []
+                while (chunks or suspects or in_flight) and not lost:
+                    if suspects:
+                        # Jobs that were on a broken pool run alone, so the one that breaks it again is known
+                        if not in_flight:
+                            chunk = [suspects.popleft()]
+                            in_flight[executor.submit(_watermark_files, chunk)] = chunk
+                    else:
+                        while chunks and len(in_flight) < self.workers * 2:
+                            chunk = chunks.popleft()
+                            in_flight[executor.submit(_watermark_files, chunk)] = chunk
+
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        chunk = in_flight.pop(future)
+                        try:
+                            results = future.result()
+                        except BrokenProcessPool:
+                            lost.extend(chunk)
+                            continue
+                        for (input_path, error, data), (_, output_path) in zip(results, chunk):
+                            self.collect_metrics(data)
+                            if error:
+                                fail(input_path, error)
+                            else:
+                                self.record_output(output_path)
+
+                if lost:
+                    self.requeue_lost(lost + [job for chunk in in_flight.values() for job in chunk], suspects, fail)
+        return failed
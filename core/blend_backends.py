@@ -0,0 +1,83 @@
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; only the numpy backend needs it
+    np = None
+
+from PIL import Image
+
+
+class PillowBlender:
+    name = "pillow"
+
+    def prepare_tile(self, tile):
+        # alpha_composite takes straight alpha; premultiplied tiles (cached logos) are converted once here
+        return tile.convert("RGBA") if tile.mode == "RGBa" else tile
+
+    def blend(self, base, tile, box, source, opacity=255):
+        if opacity < 255:
+            tile = tile.copy()
+            tile.putalpha(tile.getchannel("A").point(lambda a: a * opacity // 255))
+
+        if base.mode == "RGBA":
+            base.alpha_composite(tile, dest=box[:2], source=source)
+            return base
+
+        # Opaque bases only round-trip the covered region through RGBA
+        region = base.crop(box).convert("RGBA")
+        region.alpha_composite(tile, source=source)
+        base.paste(region.convert(base.mode), box[:2])
+        return base
+
+
+class NumpyBlender:
+    name = "numpy"
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("The numpy blend backend requires NumPy (pip install numpy).")
+
+    def prepare_tile(self, tile):
+        # Tiles are blended as they come, straight or premultiplied (cached logos), and straightened per blend
+        return tile
+
+    def blend(self, base, tile, box, source, opacity=255):
+        # alpha_composite's integer arithmetic (7 extra bits, rounded divisions by 255) in one fused pass over the
+        # covered region only, so results are exactly the pillow backend's on opaque and transparent bases alike
+        src = np.asarray(tile.crop(source), dtype=np.uint32)
+        dst = np.asarray(base.crop(box), dtype=np.uint32)
+
+        src_alpha = src[..., 3:4] * opacity // 255
+        if tile.mode == "RGBa":
+            # Straightened like Pillow's RGBa to RGBA conversion
+            alpha = src[..., 3:4]
+            straight = np.minimum(src[..., :3] * 255 // np.maximum(alpha, 1), 255)
+            src_color = np.where((alpha == 0) | (alpha == 255), src[..., :3], straight)
+        else:
+            src_color = src[..., :3]
+
+        if base.mode == "RGBA":
+            out_alpha = src_alpha * 255 + dst[..., 3:4] * (255 - src_alpha)
+            coef = src_alpha * (255 * 255 << 7) // np.maximum(out_alpha, 1)
+        else:
+            # Over an opaque base the output alpha is always 255, which reduces the weight to src_alpha << 7
+            coef = src_alpha << 7
+        color = src_color * coef + dst[..., :3] * ((255 << 7) - coef) + (0x80 << 7)
+        out = ((color >> 8) + color) >> 15
+
+        if base.mode == "RGBA":
+            out_alpha += 0x80
+            out = np.concatenate([out, ((out_alpha >> 8) + out_alpha) >> 8], axis=-1)
+            # Pillow leaves pixels the tile does not cover as they were, colour included
+            out = np.where(src_alpha > 0, out, dst)
+
+        base.paste(Image.fromarray(out.astype(np.uint8)), box[:2])
+        return base
+
+
+BLENDERS = {PillowBlender.name: PillowBlender, NumpyBlender.name: NumpyBlender}
+
+
+def get_blender(name):
+    if name not in BLENDERS:
+        raise ValueError(f"Unknown blend backend '{name}'. Available: {', '.join(BLENDERS)}.")
+    return BLENDERS[name]()
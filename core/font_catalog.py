@@ -0,0 +1,158 @@
+import contextlib
+import io
+import json
+import os
+import struct
+import tempfile
+from pathlib import Path
+
+from PIL import ImageFont
+
+from config import config
+
+
+class FontCatalog:
+    index_version = 1
+
+    def __init__(self, fonts_dir=config.FONT_DIR, index_file=config.FONT_INDEX_FILE, preload=True):
+        self.fonts_dir = Path(fonts_dir).resolve()
+        self.index_file = Path(index_file)
+        self.entries = {}
+        self.styles = {}
+        self.font_data = {}
+
+        if not self.fonts_dir.exists():
+            raise FileNotFoundError(f"Fonts directory '{self.fonts_dir}' does not exist.")
+
+        self.load()
+        if preload:
+            self.preload()
+
+    def get_font_files(self):
+        return sorted(font_file for font_dir in self.fonts_dir.iterdir() if font_dir.is_dir()
+                      for font_file in font_dir.glob("*.ttf"))
+
+    def get_signature(self, font_file):
+        stat = font_file.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def load(self):
+        # Reparse fonts only when the index is missing or any file was added, removed or modified
+        font_files = self.get_font_files()
+        signatures = {str(f.relative_to(self.fonts_dir)): self.get_signature(f) for f in font_files}
+
+        index = self.read_index()
+        if not index or index.get("version") != self.index_version or \
+                {key: entry["signature"] for key, entry in index["fonts"].items()} != signatures:
+            index = {"version": self.index_version,
+                     "fonts": {key: dict(self.inspect(self.fonts_dir / key), signature=signature)
+                               for key, signature in signatures.items()}}
+            self.write_index(index)
+
+        self.entries = index["fonts"]
+        self.styles = {(entry["family"], entry["italic"]): key for key, entry in self.entries.items()}
+
+    def read_index(self):
+        try:
+            with open(self.index_file) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def write_index(self, index):
+        # Several workers may build a missing index at once, so each writes its own temporary file before the
+        # atomic replace; whichever lands last wins with a complete index
+        tmp_file = None
+        try:
+            with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(self.index_file)), suffix=".tmp",
+                                             delete=False) as fp:
+                tmp_file = fp.name
+                json.dump(index, fp, separators=(",", ":"))
+            os.replace(tmp_file, self.index_file)
+        except OSError:
+            # A read-only install still works; the fonts are just reparsed on the next start
+            if tmp_file is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_file)
+
+    def inspect(self, font_file):
+        with open(font_file, "rb") as fp:
+            data = fp.read()
+
+        font = ImageFont.truetype(io.BytesIO(data), 10)
+        tables = self.read_table_directory(data)
+        axes, coordinates = self.read_fvar(data, tables.get(b"fvar"))
+        names = [name.decode() if isinstance(name, bytes) else name for name in font.get_variation_names()] \
+            if axes else []
+
+        return {
+            "family": font_file.parent.name,
+            "name": font.getname()[0],
+            "italic": self.read_italic_angle(data, tables.get(b"post")) != 0 or "Italic" in font_file.stem,
+            "axes": axes,
+            "instances": dict(zip(names, coordinates)),
+        }
+
+    def read_table_directory(self, data):
+        num_tables = struct.unpack_from(">H", data, 4)[0]
+        tables = {}
+        for i in range(num_tables):
+            tag, _, offset, length = struct.unpack_from(">4sIII", data, 12 + i * 16)
+            tables[tag] = offset
+        return tables
+
+    def read_fvar(self, data, offset):
+        if offset is None:
+            return [], []
+
+        axes_offset, _, axis_count, axis_size, instance_count, instance_size = struct.unpack_from(">HHHHHH", data,
+                                                                                                  offset + 4)
+        axes = []
+        for i in range(axis_count):
+            tag, minimum, default, maximum = struct.unpack_from(">4siii", data, offset + axes_offset + i * axis_size)
+            axes.append({"tag": tag.decode(), "min": minimum / 65536, "default": default / 65536,
+                         "max": maximum / 65536})
+
+        coordinates = []
+        instances_offset = offset + axes_offset + axis_count * axis_size
+        for i in range(instance_count):
+            values = struct.unpack_from(f">{axis_count}i", data, instances_offset + i * instance_size + 4)
+            coordinates.append([value / 65536 for value in values])
+        return axes, coordinates
+
+    def read_italic_angle(self, data, offset):
+        return struct.unpack_from(">i", data, offset + 4)[0] / 65536 if offset is not None else 0
+
+    def preload(self):
+        for key in self.entries:
+            if key not in self.font_data:
+                with open(self.fonts_dir / key, "rb") as fp:
+                    self.font_data[key] = fp.read()
+
+    def get_families(self):
+        return sorted({entry["family"] for entry in self.entries.values()})
+
+    def has_family(self, family):
+        return (family, False) in self.styles or (family, True) in self.styles
+
+    def resolve(self, family, weight=400, width=100, italic=False):
+        # One dict lookup picks the file; the requested weight/width are clamped onto its axes
+        key = self.styles.get((family, italic))
+        if key is None:
+            if not self.has_family(family):
+                raise ValueError(f"Font '{family}' not found.")
+            raise ValueError(f"Font style '{'italic' if italic else 'upright'}' not available for '{family}'.")
+
+        requested = {"wght": weight, "wdth": width}
+        axes = [min(axis["max"], max(axis["min"], requested.get(axis["tag"], axis["default"])))
+                for axis in self.entries[key]["axes"]]
+        return key, axes
+
+    def load_font(self, key, axes, size):
+        if key not in self.font_data:
+            self.preload()
+
+        font = ImageFont.truetype(io.BytesIO(self.font_data[key]), size, layout_engine=ImageFont.Layout.BASIC)
+        if axes:
+            font.set_variation_by_axes(axes)
+        return font
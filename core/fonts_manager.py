@@ -1,51 +1,68 @@
-import os.path
-from pathlib import Path
-
-from PIL import ImageFont
+import threading
+from collections import OrderedDict
 
 from config import config
+from core.font_catalog import FontCatalog
+from core.metrics import metrics
 
 
 class FontsManager:
-    def __init__(self, fonts_dir=config.FONT_DIR):
-        self.fonts_dir = Path(fonts_dir).resolve()
-        self.fonts = {}
-        self.italic_fonts = {}
+    def __init__(self, fonts_dir=config.FONT_DIR, cache_size=config.FONT_CACHE_SIZE):
+        self.catalog = FontCatalog(fonts_dir)
         self.font_sizes = list(range(10, 72, 1))
-        self.style_mapping = {"bold": "Bold", "italic": "Italic", "normal": "Regular"}
-        self._init_fonts()
+        # Style name -> (weight, italic); any other weight is reachable through the weight argument
+        self.style_mapping = {"normal": (400, False), "bold": (700, False), "italic": (400, True),
+                              "bold italic": (700, True)}
 
-    def _init_fonts(self):
-        if not self.fonts_dir.exists():
-            raise FileNotFoundError(f"Fonts directory '{self.fonts_dir}' does not exist.")
+        # Parsed font objects keyed by (name, size, style, weight, width), least recently used first
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
 
-        for font_dir in self.fonts_dir.iterdir():
-            if not font_dir.is_dir():
-                continue
+    def get_font(self, name, size, style="normal", weight=None, width=None):
+        key = (name, size, style, weight, width)
+        with self.cache_lock:
+            font = self.cache.get(key)
+            if font is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                metrics.count("font_cache_hits")
+                return font
 
-            for font_file in list(font_dir.glob("*.ttf")):
-                if "Italic" in font_file.stem:
-                    self.italic_fonts[font_dir.name] = font_file
-                else:
-                    self.fonts[font_dir.name] = font_file
+            self.misses += 1
+            metrics.count("font_cache_misses")
+            with metrics.span("font_lookup"):
+                font = self._load_font(name, size, style, weight, width)
+            self.cache[key] = font
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
 
-    def get_font(self, name, size, style="normal"):
-        if name not in self.fonts and name not in self.italic_fonts:
-            raise ValueError(f"Font '{name}' not found.")
+        return font
 
-        style_name = self.style_mapping.get(style, "Regular")
-        font_path = self.italic_fonts.get(name) if style_name == "Italic" else self.fonts.get(name)
+    def _load_font(self, name, size, style, weight=None, width=None):
+        style_weight, italic = self.style_mapping.get(style, self.style_mapping["normal"])
+        key, axes = self.catalog.resolve(name, weight or style_weight, width or 100, italic)
+        return self.catalog.load_font(key, axes, size)
 
-        if not font_path:
-            raise ValueError(f"Font style '{style}' not available for '{name}'.")
+    def warm_cache(self, names=None, sizes=None, styles=None):
+        for name in names or [config.DEFAULT_FONT]:
+            for style in styles or [config.DEFAULT_FONT_STYLE]:
+                for size in sizes or self.font_sizes:
+                    self.get_font(name, size, style)
 
-        font = ImageFont.truetype(str(font_path), size, layout_engine=ImageFont.Layout.BASIC)
-        font.set_variation_by_name(style_name)
+    def clear_cache(self):
+        with self.cache_lock:
+            self.cache.clear()
+            self.hits = self.misses = 0
 
-        return font
+    def cache_info(self):
+        with self.cache_lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.cache), "max_size": self.cache_size}
 
     def get_all_fonts(self):
-        return list(self.fonts.keys())
+        return self.catalog.get_families()
 
     def get_available_styles(self):
         return list(self.style_mapping.keys())
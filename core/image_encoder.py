@@ -0,0 +1,114 @@
+import io
+import os
+
+from PIL import Image, JpegImagePlugin, PngImagePlugin
+
+from config import config
+from core.metrics import metrics
+
+
+class ImageEncoder:
+    alpha_formats = ("PNG", "WEBP", "TIFF")
+    metadata_formats = ("PNG", "JPEG", "WEBP", "TIFF")
+    extensions = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp", "TIFF": ".tif", "BMP": ".bmp"}
+
+    def __init__(self, default_format=config.OUTPUT_FORMAT, preserve_metadata=config.PRESERVE_METADATA):
+        self.default_format = default_format.upper()
+        self.preserve_metadata = preserve_metadata
+
+    def get_format(self, path, fmt=None):
+        if fmt:
+            return fmt.upper()
+
+        ext = os.path.splitext(path)[1].lower()
+        if not ext:
+            return self.default_format
+
+        fmt = Image.registered_extensions().get(ext)
+        if fmt is None:
+            raise ValueError(f"Unsupported output format '{ext}'.")
+        return fmt
+
+    def get_extension(self, fmt=None):
+        return self.extensions.get((fmt or self.default_format).upper(), f".{(fmt or self.default_format).lower()}")
+
+    def get_save_options(self, fmt):
+        if fmt == "JPEG":
+            return {"quality": config.JPEG_QUALITY, "subsampling": config.JPEG_SUBSAMPLING,
+                    "progressive": config.JPEG_PROGRESSIVE, "optimize": config.JPEG_OPTIMIZE}
+        if fmt == "PNG":
+            return {"compress_level": config.PNG_COMPRESS_LEVEL, "optimize": config.PNG_OPTIMIZE}
+        if fmt == "WEBP":
+            return {"lossless": config.WEBP_LOSSLESS, "quality": config.WEBP_QUALITY, "method": config.WEBP_METHOD}
+        return {}
+
+    def get_keep_options(self, source):
+        # Re-encodes with the JPEG source's own quantization tables and chroma subsampling, so blocks the
+        # watermark did not touch come out (almost) exactly as they went in; quality would rescale the tables
+        options = {key: value for key, value in self.get_save_options("JPEG").items() if key != "quality"}
+        return dict(options, qtables=source.quantization, subsampling=JpegImagePlugin.get_sampling(source))
+
+    def get_metadata(self, image):
+        # EXIF, ICC profile and XMP as the source carried them (EXIF orientation is already applied at decode)
+        if not self.preserve_metadata:
+            return {}
+
+        metadata = {}
+        exif = image.info.get("exif")
+        if exif:
+            # JPEG writes the bytes as they are; PNG and WebP strip the header themselves
+            metadata["exif"] = exif if exif.startswith(b"Exif\x00\x00") else b"Exif\x00\x00" + exif
+        # A profile only describes the output if its colour space is RGB (not a grey or CMYK source's)
+        icc_profile = image.info.get("icc_profile")
+        if icc_profile and icc_profile[16:20] == b"RGB ":
+            metadata["icc_profile"] = icc_profile
+        xmp = image.info.get("xmp")
+        if xmp:
+            metadata["xmp"] = xmp.encode() if isinstance(xmp, str) else xmp
+        return metadata
+
+    def get_metadata_options(self, metadata, fmt):
+        if fmt not in self.metadata_formats:
+            return {}
+        options = {key: value for key, value in metadata.items() if key != "xmp"}
+        if "xmp" in metadata:
+            if fmt == "PNG":
+                pnginfo = PngImagePlugin.PngInfo()
+                pnginfo.add_itxt("XML:com.adobe.xmp", metadata["xmp"].decode("utf-8", "replace"), zip=True)
+                options["pnginfo"] = pnginfo
+            elif fmt == "TIFF":
+                # TIFF stores XMP as a tag next to the EXIF ones
+                exif = Image.Exif()
+                if "exif" in metadata:
+                    exif.load(metadata["exif"])
+                exif[700] = metadata["xmp"]
+                options["exif"] = exif
+            else:
+                options["xmp"] = metadata["xmp"]
+        return options
+
+    def get_output_mode(self, image, fmt):
+        # Alpha is kept only when the source has it and the format can store it
+        return "RGBA" if image.mode == "RGBA" and fmt in self.alpha_formats else "RGB"
+
+    def save(self, image, path, fmt=None, options=None):
+        # options replaces the configured encoder settings (e.g. get_keep_options); metadata comes from image.info
+        fmt = self.get_format(path, fmt)
+        mode = self.get_output_mode(image, fmt)
+        options = dict(self.get_save_options(fmt) if options is None else options,
+                       **self.get_metadata_options(self.get_metadata(image), fmt))
+        if image.mode != mode:
+            image = image.convert(mode)
+
+        with metrics.span("encode"):
+            image.save(path, fmt, **options)
+        metrics.count("images_encoded")
+        if isinstance(path, (str, os.PathLike)):
+            metrics.count("bytes_encoded", os.path.getsize(path))
+        return path
+
+    def encode(self, image, fmt, options=None):
+        buffer = io.BytesIO()
+        self.save(image, buffer, fmt.upper(), options)
+        metrics.count("bytes_encoded", buffer.tell())
+        return buffer.getvalue()
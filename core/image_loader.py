@@ -0,0 +1,125 @@
+import math
+
+from PIL import ExifTags, Image, ImageFile, ImageOps
+
+from config import config
+from core.metrics import metrics
+
+
+class ImageLoader:
+    strip_modes = ("1", "L", "P", "RGB", "RGBA")
+    # EXIF orientations that turn the image sideways, swapping its displayed width and height
+    swapped_orientations = (5, 6, 7, 8)
+
+    def __init__(self, reducing_gap=config.PREVIEW_REDUCING_GAP, memory_limit_mb=config.STREAM_MEMORY_LIMIT_MB):
+        self.reducing_gap = reducing_gap
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+
+    def open(self, path):
+        # Only the header is read here; pixels are decoded on first use (save time)
+        try:
+            return Image.open(path)
+        except Image.DecompressionBombError:
+            image = self.open_unbounded(path)
+            if not self.is_strip_readable(image):
+                image.close()
+                raise
+            return image
+
+    def open_unbounded(self, path):
+        # Strip reads never decode the whole image, so Pillow's decompression bomb limit does not apply to them
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            return Image.open(path)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+
+    def is_streamable(self, path):
+        with self.open_unbounded(path) as image:
+            return self.exceeds_memory_limit(image.size) and self.is_strip_readable(image)
+
+    def exceeds_memory_limit(self, size):
+        # A full decode holds the original, its RGBA copy and the RGB result at once
+        return size[0] * size[1] * 4 * 3 > self.memory_limit
+
+    def get_orientation(self, image):
+        return image.getexif().get(ExifTags.Base.Orientation, 1)
+
+    def orient_size(self, image, size):
+        # Maps a size between the stored and the displayed orientation (the swap is its own inverse)
+        return tuple(size[::-1]) if self.get_orientation(image) in self.swapped_orientations else tuple(size)
+
+    def is_strip_readable(self, image):
+        # Strips come out in stored order, so sources that EXIF rotates or flips take the full decode path
+        if image.mode not in self.strip_modes or self.get_orientation(image) != 1:
+            return False
+
+        # Strips can be decoded independently only when rows are stored uncompressed, as in PPM, BMP and raw TIFF
+        return bool(image.tile) and all(
+            tile[0] == "raw" and tile[1][0] == 0 and tile[1][2] == image.width for tile in image.tile)
+
+    def get_strip_height(self, width):
+        # Budget per row: the decoded strip, its packed bytes, the filtered rows and the compressor's input
+        return max(1, self.memory_limit // 4 // (width * 4 * 4))
+
+    def get_row_stride(self, mode, width, rawmode, stride):
+        if stride:
+            return stride
+        return len(Image.new(mode, (width, 1)).tobytes("raw", rawmode))
+
+    def read_strip(self, path, top, bottom):
+        # Reopen and narrow the raw tiles to the requested rows; load() then closes the file itself
+        image = self.open_unbounded(path)
+        tiles = []
+        for codec, (x0, y0, x1, y1), offset, args in image.tile:
+            first, last = max(top, y0), min(bottom, y1)
+            if first >= last:
+                continue
+
+            rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+            stride = self.get_row_stride(image.mode, image.width, rawmode, stride)
+            row = first - y0 if orientation > 0 else y1 - last
+            tiles.append(ImageFile._Tile(codec, (0, first - top, image.width, last - top), offset + row * stride,
+                                         (rawmode, stride, orientation)))
+
+        image._size = (image.width, bottom - top)
+        if hasattr(image, "_tile_size"):
+            # TIFF allocates its decode buffer from _tile_size rather than size
+            image._tile_size = image._size
+        image.tile = tiles
+        image.load()
+        return image
+
+    def iter_strips(self, path, size):
+        strip_height = self.get_strip_height(size[0])
+        for top in range(0, size[1], strip_height):
+            bottom = min(size[1], top + strip_height)
+            yield top, self.read_strip(path, top, bottom)
+
+    def load_preview(self, path, size):
+        with metrics.span("thumbnail"):
+            image = self.open(path)
+            if self.exceeds_memory_limit(image.size) and self.is_strip_readable(image):
+                return self.load_preview_from_strips(path, image.size, image.mode, size)
+
+            # Let the decoder produce a reduced image no smaller than the target (JPEG DCT scaling) before resampling
+            size = self.orient_size(image, size)
+            image.draft(None, size)
+            image.thumbnail(size, reducing_gap=self.reducing_gap)
+            ImageOps.exif_transpose(image, in_place=True)
+            return image
+
+    def load_preview_from_strips(self, path, image_size, mode, size):
+        # Box-reduce each strip as it is read so the full-resolution image never exists in memory
+        factor = max(1, math.floor(min(image_size[0] / size[0], image_size[1] / size[1]) / self.reducing_gap))
+        mode = "RGBA" if mode == "RGBA" else "RGB"
+        reduced = Image.new(mode, (math.ceil(image_size[0] / factor), math.ceil(image_size[1] / factor)))
+
+        strip_height = max(factor, self.get_strip_height(image_size[0]) // factor * factor)
+        for top in range(0, image_size[1], strip_height):
+            strip = self.read_strip(path, top, min(image_size[1], top + strip_height))
+            reduced.paste(strip.convert(mode).reduce(factor), (0, top // factor))
+
+        reduced.thumbnail(size)
+        return reduced
@@ -0,0 +1,121 @@
+import math
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+from config import config
+from core.metrics import metrics
+
+
+class ImagePyramid:
+    def __init__(self, path, loader, tile_size=config.PREVIEW_TILE_SIZE,
+                 tile_cache_size=config.PREVIEW_TILE_CACHE_SIZE, level_cache_size=config.PREVIEW_LEVEL_CACHE_SIZE):
+        # Level 0 is the full-resolution image and every next level halves it. Nothing is decoded up front;
+        # levels and their tiles are produced the first time a view needs them
+        self.path = path
+        self.loader = loader
+        self.tile_size = tile_size
+        self.tile_cache_size = tile_cache_size
+        self.level_cache_size = level_cache_size
+        self.levels = OrderedDict()
+        self.tiles = OrderedDict()
+
+        with loader.open(path) as image:
+            # Levels are in displayed orientation; EXIF rotation is applied as each level is decoded
+            self.size = loader.orient_size(image, image.size)
+            self.mode = image.mode
+            self.streamable = loader.exceeds_memory_limit(image.size) and loader.is_strip_readable(image)
+
+    def get_level_size(self, level):
+        return tuple(math.ceil(side / 2 ** level) for side in self.size)
+
+    def get_levels(self, min_size):
+        # Levels larger than min_size, coarsest first: the zoom steps above a view of that size
+        levels = []
+        level = 0
+        while all(side > limit for side, limit in zip(self.get_level_size(level), min_size)):
+            levels.insert(0, level)
+            level += 1
+        return levels
+
+    def get_level(self, level):
+        image = self.levels.get(level)
+        if image is not None:
+            self.levels.move_to_end(level)
+            return image
+
+        with metrics.span("pyramid_level"):
+            image = self.load_level(level)
+        self.levels[level] = image
+        while len(self.levels) > self.level_cache_size:
+            self.levels.popitem(last=False)
+        return image
+
+    def load_level(self, level):
+        size = self.get_level_size(level)
+        finer = max((cached for cached in self.levels if cached < level), default=None)
+        if finer is not None:
+            # A finer level already in memory is reduced exactly, without touching the file again
+            image = self.levels[finer].reduce(2 ** (level - finer))
+        elif self.streamable:
+            image = self.loader.load_preview_from_strips(self.path, self.size, self.mode, size)
+        else:
+            # JPEG decodes straight at 1/2, 1/4 or 1/8 scale; other formats are decoded in full once
+            image = self.loader.open(self.path)
+            image.draft(None, self.loader.orient_size(image, size))
+            image.load()
+            ImageOps.exif_transpose(image, in_place=True)
+            image = self.to_reducible(image)
+
+        if image.size != size:
+            image = image.resize(size, reducing_gap=self.loader.reducing_gap)
+        return image
+
+    @staticmethod
+    def to_reducible(image):
+        # reduce() cannot average palette or bilevel pixels (and resize() falls back to nearest for them), so levels
+        # are held in RGB, or RGBA when the source has transparency, as previews read from strips are
+        if image.mode in ("RGB", "RGBA"):
+            return image
+        return image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+    def get_tile(self, level, column, row):
+        key = level, column, row
+        tile = self.tiles.get(key)
+        metrics.count("pyramid_tile_misses" if tile is None else "pyramid_tile_hits")
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+
+        box = self.get_tile_box(level, column, row)
+        if self.streamable and self.loader.exceeds_memory_limit(self.get_level_size(level)):
+            tile = self.read_tile(level, box)
+        else:
+            tile = self.get_level(level).crop(box)
+        tile = self.tiles[key] = tile.convert("RGBA")
+        while len(self.tiles) > self.tile_cache_size:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def get_tile_box(self, level, column, row):
+        width, height = self.get_level_size(level)
+        left, top = column * self.tile_size, row * self.tile_size
+        return left, top, min(width, left + self.tile_size), min(height, top + self.tile_size)
+
+    def read_tile(self, level, box):
+        # Levels too large to hold in memory are cut from only the source rows the tile covers
+        factor = 2 ** level
+        top, bottom = box[1] * factor, min(self.size[1], box[3] * factor)
+        strip = self.loader.read_strip(self.path, top, bottom)
+        region = strip.crop((box[0] * factor, 0, min(self.size[0], box[2] * factor), bottom - top))
+        return self.to_reducible(region).reduce(factor) if factor > 1 else region
+
+    def get_region(self, level, box):
+        # Only the tiles under box are produced (or taken from the cache) and pasted together
+        region = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]))
+        width, height = self.get_level_size(level)
+        size = self.tile_size
+        for row in range(max(0, box[1]) // size, (min(box[3], height) - 1) // size + 1):
+            for column in range(max(0, box[0]) // size, (min(box[2], width) - 1) // size + 1):
+                region.paste(self.get_tile(level, column, row), (column * size - box[0], row * size - box[1]))
+        return region
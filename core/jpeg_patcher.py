@@ -0,0 +1,120 @@
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from PIL import Image, JpegImagePlugin
+
+from config import config
+from core.image_loader import ImageLoader
+from core.layer_compositor import LayerCompositor
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class JpegPatcher:
+    # iMCU size in pixels per JpegImagePlugin.get_sampling value (4:4:4, 4:2:2, 4:2:0)
+    mcu_sizes = {0: (8, 8), 1: (16, 8), 2: (16, 16)}
+
+    def __init__(self, renderer, loader=None, jpegtran=config.JPEGTRAN, max_area=config.JPEG_PATCH_MAX_AREA):
+        # JPEG to JPEG without generational loss: only the blocks under the watermark are re-encoded
+        self.renderer = renderer
+        self.loader = loader or ImageLoader()
+        self.max_area = max_area
+        self.jpegtran = self.find_jpegtran(jpegtran)
+
+    def find_jpegtran(self, name):
+        # Lossless patching needs a jpegtran with -drop (libjpeg 9, libjpeg-turbo 3); without one every image is
+        # re-encoded in full, but with its own quantization tables
+        path = shutil.which(name) if name else None
+        if path is None:
+            return None
+        try:
+            usage = subprocess.run([path, "-help"], capture_output=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        return path if b"-drop" in usage.stdout + usage.stderr else None
+
+    def is_patchable(self, image, fmt):
+        return fmt == "JPEG" and image.format == "JPEG" and image.mode == "RGB"
+
+    def can_patch(self, input_path, output_path):
+        with self.loader.open(input_path) as image:
+            return self.is_patchable(image, self.renderer.encoder.get_format(output_path))
+
+    def get_patch_rects(self, placements, size, mcu):
+        # Tile boxes grown to whole iMCUs (clamped at the right and bottom edges), overlapping ones merged
+        rects = []
+        for tile, (x, y), _ in placements:
+            left, top = max(0, x) // mcu[0] * mcu[0], max(0, y) // mcu[1] * mcu[1]
+            right = min(size[0], -(-(x + tile.width) // mcu[0]) * mcu[0])
+            bottom = min(size[1], -(-(y + tile.height) // mcu[1]) * mcu[1])
+            if left < right and top < bottom:
+                rects.append((left, top, right, bottom))
+        return LayerCompositor.merge_rects(rects)
+
+    def render_file(self, input_path, output_path, options, scale_factor=None):
+        with self.loader.open(input_path) as image:
+            size, orientation = image.size, self.loader.get_orientation(image)
+            mcu = self.mcu_sizes.get(JpegImagePlugin.get_sampling(image))
+
+        # Rotated sources are laid out after decode, so only upright ones can be patched in place
+        if self.jpegtran and mcu and orientation == 1:
+            placements = self.renderer.get_placements(options, size, scale_factor)
+            rects = self.get_patch_rects(placements, size, mcu)
+            if sum((r[2] - r[0]) * (r[3] - r[1]) for r in rects) <= self.max_area * size[0] * size[1]:
+                try:
+                    return self.patch_file(input_path, output_path, placements, rects)
+                except subprocess.CalledProcessError as e:
+                    logger.warning("jpegtran failed on %s (%s), re-encoding it in full", input_path,
+                                   e.stderr.decode(errors="replace").strip())
+
+        return self.reencode_file(input_path, output_path, options, scale_factor)
+
+    def patch_file(self, input_path, output_path, placements, rects):
+        # Each region is cut out losslessly, decoded, watermarked, encoded with the source's tables and dropped
+        # back in; every other block (and the metadata, if PRESERVE_METADATA) is copied by jpegtran without decoding
+        copy = "all" if self.renderer.encoder.preserve_metadata else "none"
+        with metrics.span("jpeg_patch"), tempfile.TemporaryDirectory(
+                dir=os.path.dirname(os.path.abspath(output_path))) as tmp_dir:
+            current = input_path
+            for index, (left, top, right, bottom) in enumerate(rects):
+                crop = self.run("-copy", "none", "-crop", f"{right - left}x{bottom - top}+{left}+{top}", input_path)
+                patch_path = os.path.join(tmp_dir, f"patch-{index}.jpg")
+                with Image.open(io.BytesIO(crop)) as region:
+                    region.load()
+                    for tile, (x, y), opacity in placements:
+                        self.renderer.composite_tile(region, tile, (x - left, y - top), opacity)
+                    region.save(patch_path, "JPEG", **self.renderer.encoder.get_keep_options(region))
+
+                target = os.path.join(tmp_dir, f"output-{index}.jpg")
+                self.run("-copy", copy, "-drop", f"+{left}+{top}", patch_path, "-outfile", target, current)
+                current = target
+                metrics.count("jpeg_patched_pixels", (right - left) * (bottom - top))
+
+            if current == input_path and copy == "none":
+                # Nothing to patch, but the metadata still has to go
+                current = os.path.join(tmp_dir, "output.jpg")
+                self.run("-copy", "none", "-outfile", current, input_path)
+
+            if current == input_path:
+                shutil.copyfile(input_path, output_path)
+            else:
+                os.replace(current, output_path)
+
+        metrics.count("bytes_encoded", os.path.getsize(output_path))
+        return output_path
+
+    def reencode_file(self, input_path, output_path, options, scale_factor=None):
+        # Full decode and encode, but with the source's quantization tables, so untouched blocks barely change
+        with Image.open(input_path) as image:
+            save_options = self.renderer.encoder.get_keep_options(image)
+            self.renderer.decode(image)
+            watermarked = self.renderer.render(image, options, scale_factor, in_place=True)
+            return self.renderer.encoder.save(watermarked, output_path, "JPEG", save_options)
+
+    def run(self, *args):
+        return subprocess.run([self.jpegtran, *args], capture_output=True, check=True).stdout
@@ -0,0 +1,107 @@
+from core.metrics import metrics
+from core.watermark_spec import WatermarkSpec
+
+
+class LayerCompositor:
+    def __init__(self, renderer):
+        self.renderer = renderer
+
+        self.base = None
+        self.image = None
+        # The image can be a window onto a larger canvas (a zoomed preview); layers are laid out on the canvas
+        self.canvas_size = None
+        self.origin = (0, 0)
+        # Per layer id: (sprite key, prepared tile, offset) and what was last composited (tile, positions, opacity, z)
+        self.sprites = {}
+        self.placed = {}
+
+    def set_base(self, image, mode=None, canvas_size=None, origin=(0, 0), copy=True):
+        # The untouched base is kept so dirty rectangles can be restored before recompositing them. With copy=False
+        # an image already in the render mode is used as the base itself; the caller must not change it afterwards
+        mode = mode or self.renderer.get_render_mode(image)
+        if image.mode != mode:
+            self.base = image.convert(mode)
+        else:
+            self.base = image.copy() if copy else image
+        self.image = self.base.copy()
+        self.canvas_size = canvas_size or image.size
+        self.origin = origin
+        self.placed = {}
+
+    def get_sprite(self, layer, pixels):
+        key = (layer.get_sprite_key(pixels), self.renderer.blender.name)
+        entry = self.sprites.get(layer.id)
+        if entry is None or entry[0] != key:
+            tile, offset = layer.rasterize(self.renderer, pixels)
+            entry = self.sprites[layer.id] = key, self.renderer.blender.prepare_tile(tile), offset
+        return entry[1], entry[2]
+
+    def place(self, layers):
+        # Layers are laid out for this image's size through the same spec mapping that batch rendering uses
+        layers = [layer for layer in layers if layer.visible]
+        layout = WatermarkSpec.from_layers(layers).get_layout(self.canvas_size)
+        origin_x, origin_y = self.origin
+
+        placed = {}
+        for z, (layer, pixels) in enumerate(zip(layers, layout)):
+            tile, offset = self.get_sprite(layer, pixels)
+            positions = ((x - origin_x, y - origin_y) for x, y in
+                         self.renderer.get_tile_positions(self.canvas_size, pixels, tile, offset))
+            positions = tuple(position for position in positions
+                              if self.clip((*position, position[0] + tile.width, position[1] + tile.height)))
+            bounds = self.clip((min((x for x, _ in positions), default=0), min((y for _, y in positions), default=0),
+                                max((x + tile.width for x, _ in positions), default=0),
+                                max((y + tile.height for _, y in positions), default=0)))
+            placed[layer.id] = (tile, positions, layer.get_opacity(pixels), z, bounds)
+        return placed
+
+    def render(self, layers):
+        # Returns the rectangles that changed; everything else in self.image is left as it was
+        with metrics.span("composite"):
+            return self.composite(self.place(layers))
+
+    def composite(self, placed):
+        dirty = []
+        for layer_id in self.placed.keys() | placed.keys():
+            old, new = self.placed.get(layer_id), placed.get(layer_id)
+            if old and new and old[0] is new[0] and old[1:4] == new[1:4]:
+                continue
+            dirty += [entry[4] for entry in (old, new) if entry and entry[4]]
+
+        rects = self.merge_rects(dirty)
+        for rect in rects:
+            self.image.paste(self.base.crop(rect), rect[:2])
+            for tile, positions, opacity, _, bounds in placed.values():
+                if not bounds or not self.intersects(bounds, rect):
+                    continue
+                for x, y in positions:
+                    if self.intersects((x, y, x + tile.width, y + tile.height), rect):
+                        self.renderer.composite_tile(self.image, tile, (x, y), opacity, clip=rect)
+
+        self.placed = placed
+        self.sprites = {layer_id: entry for layer_id, entry in self.sprites.items() if layer_id in placed}
+        return rects
+
+    def clip(self, rect):
+        left, top = max(0, rect[0]), max(0, rect[1])
+        right, bottom = min(self.image.width, rect[2]), min(self.image.height, rect[3])
+        return (left, top, right, bottom) if left < right and top < bottom else None
+
+    @staticmethod
+    def intersects(a, b):
+        return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+    @staticmethod
+    def merge_rects(rects):
+        # Overlapping rectangles collapse into their union so no pixel is restored or blended twice
+        merged = []
+        for rect in rects:
+            while True:
+                overlap = next((other for other in merged if LayerCompositor.intersects(rect, other)), None)
+                if overlap is None:
+                    break
+                merged.remove(overlap)
+                rect = (min(rect[0], overlap[0]), min(rect[1], overlap[1]),
+                        max(rect[2], overlap[2]), max(rect[3], overlap[3]))
+            merged.append(rect)
+        return merged
@@ -0,0 +1,110 @@
+import itertools
+import json
+
+_layer_ids = itertools.count(1)
+
+
+class Layer:
+    kind = None
+    # Parameters that only move or fade the sprite; everything else changes its pixels
+    placement_keys = ("x", "y", "position", "margin", "spacing", "opacity")
+
+    def __init__(self, x=0, y=0, opacity=255, rotation=0, scale=1.0, position=None, margin=None, spacing=None,
+                 visible=True):
+        # Geometry is normalized (see core.watermark_spec): x/y are fractions of the image width/height, margin and
+        # spacing fractions of its shorter side; position "tile" repeats the sprite on a grid through x/y
+        self.id = next(_layer_ids)
+        self.x = x
+        self.y = y
+        self.opacity = opacity
+        self.rotation = rotation
+        self.scale = scale
+        self.position = position
+        self.margin = margin
+        self.spacing = spacing
+        self.visible = visible
+
+    def update(self, **params):
+        for name, value in params.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"{type(self).__name__} has no parameter '{name}'.")
+            setattr(self, name, value)
+        return self
+
+    def get_params(self):
+        return {"x": self.x, "y": self.y, "opacity": self.opacity, "rotation": self.rotation, "scale": self.scale,
+                "position": self.position, "margin": self.margin, "spacing": self.spacing}
+
+    def to_spec(self):
+        params = {key: value for key, value in self.get_params().items() if value is not None}
+        return dict(params, type=self.kind)
+
+    def get_sprite_key(self, pixels):
+        return json.dumps({key: value for key, value in pixels.items() if key not in self.placement_keys},
+                          sort_keys=True)
+
+    def get_opacity(self, pixels):
+        # Opacity the compositor blends the sprite with
+        return pixels.get("opacity", 255)
+
+    def draw(self, renderer, pixels):
+        raise NotImplementedError
+
+    def rasterize(self, renderer, pixels):
+        tile, offset = self.draw(renderer, pixels)
+        return renderer.rotate_tile(tile, offset, pixels.get("rotation", 0))
+
+
+class TextLayer(Layer):
+    kind = "text"
+    option_keys = ("text", "font_name", "font_size", "font_style", "color", "font_weight", "font_width", "x", "y",
+                   "position", "margin", "rotation", "spacing")
+
+    def __init__(self, text, font_name, font_size, font_style="normal", color=(255, 255, 255, 255),
+                 font_weight=None, font_width=None, **kwargs):
+        super().__init__(**kwargs)
+        self.text = text
+        self.font_name = font_name
+        self.font_size = font_size
+        self.font_style = font_style
+        self.color = color
+        self.font_weight = font_weight
+        self.font_width = font_width
+
+    @classmethod
+    def from_options(cls, options, **kwargs):
+        return cls(**{key: options[key] for key in cls.option_keys if key in options}, **kwargs)
+
+    def update_from_options(self, options):
+        return self.update(**{key: options[key] for key in self.option_keys if key in options})
+
+    def get_params(self):
+        return dict(super().get_params(), text=self.text, font_name=self.font_name, font_size=self.font_size,
+                    font_style=self.font_style, color=self.color, font_weight=self.font_weight,
+                    font_width=self.font_width)
+
+    def draw(self, renderer, pixels):
+        return renderer.get_text_tile(pixels["text"], renderer.get_font(pixels), pixels["color"])
+
+
+class ImageLayer(Layer):
+    kind = "image"
+    # Opacity is baked into the cached logo's alpha, so it is part of the sprite rather than the blend
+    placement_keys = ("x", "y", "position", "margin", "spacing")
+
+    def __init__(self, image, height, source=None, **kwargs):
+        # height is the drawn height as a fraction of the target's shorter side; the aspect ratio is kept
+        super().__init__(**kwargs)
+        self.image = image if image.mode == "RGBA" else image.convert("RGBA")
+        self.height = height
+        self.source = source or f"image-{id(image)}"
+
+    def get_params(self):
+        return dict(super().get_params(), height=self.height, source=self.source)
+
+    def get_opacity(self, pixels):
+        return 255
+
+    def draw(self, renderer, pixels):
+        logo = renderer.logos.get_logo(self.source, pixels["height"], pixels.get("opacity", 255), self.image)
+        return logo, (0, 0)
@@ -0,0 +1,65 @@
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from config import config
+from core.metrics import metrics
+
+
+class LogoCache:
+    def __init__(self, cache_mb=config.LOGO_CACHE_MB):
+        # Premultiplied logos keyed by (source, height, opacity), least recently used first, bounded by pixel bytes;
+        # height None is the logo as loaded, which every scaled copy is resampled from
+        self.cache_bytes = cache_mb * 1024 * 1024
+        self.logos = OrderedDict()
+        self.logos_bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_path(source):
+        # Relative sources (e.g. in a hand-written spec) name files in the assets image directory
+        return source if os.path.isabs(source) else config.get_image_path(source)
+
+    @staticmethod
+    def is_asset(source):
+        # Whether source resolves (through any ../ or symlinks) to a file inside the assets image directory
+        image_dir = os.path.realpath(config.IMAGE_DIR)
+        return os.path.commonpath([image_dir, os.path.realpath(LogoCache.get_path(source))]) == image_dir
+
+    def load(self, path):
+        with metrics.span("logo_load"), Image.open(path) as image:
+            return image.convert("RGBA")
+
+    def get_logo(self, source, height=None, opacity=255, image=None):
+        # image is an already loaded copy of the source (the GUI has one); otherwise it is read from disk once
+        key = (source, height, opacity)
+        with self.lock:
+            logo = self.logos.get(key)
+            if logo is not None:
+                self.logos.move_to_end(key)
+                metrics.count("logo_cache_hits")
+                return logo
+
+        metrics.count("logo_cache_misses")
+
+        if height is None:
+            image = image if image is not None else self.load(self.get_path(source))
+            logo = image.convert("RGBa")
+        elif opacity < 255:
+            # Fading a premultiplied logo scales every channel alike, so it is one lookup table over the scaled copy
+            logo = self.get_logo(source, height, 255, image).point(lambda value: value * opacity // 255)
+        else:
+            original = self.get_logo(source, None, 255, image)
+            size = max(1, round(original.width * height / original.height)), height
+            logo = original if size == original.size else original.resize(size, Image.Resampling.LANCZOS)
+
+        with self.lock:
+            if key not in self.logos:
+                self.logos[key] = logo
+                self.logos_bytes += logo.width * logo.height * 4
+            while self.logos_bytes > self.cache_bytes and len(self.logos) > 1:
+                evicted = self.logos.popitem(last=False)[1]
+                self.logos_bytes -= evicted.width * evicted.height * 4
+        return logo
@@ -0,0 +1,141 @@
+import cProfile
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def setup_logging(log_file=config.LOG_FILE, level=config.LOG_LEVEL):
+    # Entry points call this once; library modules only ever use logging.getLogger(__name__)
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(processName)s %(name)s %(levelname)s %(message)s"))
+    logging.getLogger().addHandler(handler)
+    # LOG_LEVEL applies to the app's own loggers; libraries (PIL logs every chunk it parses at DEBUG) stay at
+    # the root's default of WARNING
+    logging.getLogger("core").setLevel(level)
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    def __init__(self, enabled=config.METRICS_ENABLED):
+        self.enabled = enabled
+        self.counters = {}
+        # Span name -> [count, total seconds, max seconds]
+        self.spans = {}
+        self.lock = threading.Lock()
+        self.null_span = contextlib.nullcontext()
+
+    def span(self, name):
+        # Disabled metrics hand out one shared no-op context, so instrumented code pays a single attribute check
+        return _Span(self, name) if self.enabled else self.null_span
+
+    def record(self, name, seconds):
+        with self.lock:
+            span = self.spans.get(name)
+            if span is None:
+                span = self.spans[name] = [0, 0.0, 0.0]
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s took %.2f ms", name, seconds * 1000)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self, reset=False):
+        with self.lock:
+            data = {"counters": dict(self.counters), "spans": {name: list(span) for name, span in self.spans.items()}}
+            if reset:
+                self.counters.clear()
+                self.spans.clear()
+        return data
+
+    def merge(self, data):
+        # Folds a snapshot from another process (a batch worker) into this registry
+        with self.lock:
+            for name, value in data["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, (count, total, longest) in data["spans"].items():
+                span = self.spans.setdefault(name, [0, 0.0, 0.0])
+                span[0] += count
+                span[1] += total
+                span[2] = max(span[2], longest)
+
+    def report(self):
+        data = self.snapshot()
+        return {
+            "counters": data["counters"],
+            "spans": {name: {"count": count, "total_seconds": round(total, 4),
+                             "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+                             "max_ms": round(longest * 1000, 3)}
+                      for name, (count, total, longest) in sorted(data["spans"].items())},
+        }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def to_prometheus(self, prefix="watermark"):
+        data = self.snapshot()
+        lines = []
+        for name, value in sorted(data["counters"].items()):
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+
+        if data["spans"]:
+            lines.append(f"# TYPE {prefix}_span_seconds summary")
+            for name, (count, total, _) in sorted(data["spans"].items()):
+                lines += [f'{prefix}_span_seconds_sum{{span="{name}"}} {total:.6f}',
+                          f'{prefix}_span_seconds_count{{span="{name}"}} {count}']
+            lines.append(f"# TYPE {prefix}_span_max_seconds gauge")
+            lines += [f'{prefix}_span_max_seconds{{span="{name}"}} {longest:.6f}'
+                      for name, (_, _, longest) in sorted(data["spans"].items())]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, fmt="json"):
+        with open(path, "w") as fp:
+            fp.write(self.to_prometheus() if fmt == "prometheus" else self.to_json())
+        return path
+
+
+metrics = Metrics()
+
+
+@contextlib.contextmanager
+def profiled(profile_dir, name):
+    # Opt-in per-job cProfile; without a directory this is a plain pass-through
+    if not profile_dir:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from config import config
+from core.metrics import metrics
+
+# Bump when rendering changes in a way that should invalidate every cached output
+CACHE_VERSION = 2
+
+
+class OutputCache:
+    def __init__(self, directory, render_key, file_name=config.OUTPUT_CACHE_FILE, flush_every=256):
+        # render_key covers everything except the input: watermark options, output format and encoder settings
+        self.render_key = render_key
+        self.flush_every = flush_every
+        self.pending = []
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, file_name), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS outputs (
+            output_path TEXT PRIMARY KEY, input_path TEXT, input_size INTEGER, input_mtime_ns INTEGER,
+            input_hash TEXT, cache_key TEXT, output_size INTEGER, output_mtime_ns INTEGER)""")
+
+        # One query up front; every later lookup is a dict hit plus two stat calls
+        self.entries = {row[0]: row[1:] for row in self.db.execute("SELECT * FROM outputs")}
+
+    @staticmethod
+    def get_render_key(options_key, fmt, save_options, blend_backend, assets=()):
+        # assets are files the options only name (logos); a new size or mtime on one invalidates every output
+        signatures = []
+        for path in assets:
+            try:
+                stat = os.stat(path)
+                signatures.append([path, stat.st_size, stat.st_mtime_ns])
+            except FileNotFoundError:
+                signatures.append([path, None, None])
+        return json.dumps([CACHE_VERSION, options_key, fmt, save_options, blend_backend, signatures], sort_keys=True)
+
+    @staticmethod
+    def hash_bytes(data):
+        metrics.count("bytes_hashed", len(data))
+        return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    @staticmethod
+    def hash_file(path):
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                digest.update(chunk)
+            metrics.count("bytes_hashed", fp.tell())
+        return digest.hexdigest()
+
+    def get_key(self, input_hash):
+        return hashlib.blake2b(f"{input_hash}:{self.render_key}".encode(), digest_size=20).hexdigest()
+
+    def check(self, input_path, output_path, input_hash=None, stat_only=False):
+        # Returns (fresh, entry); entry is what record() stores once the output has been written. input_hash is the
+        # hash of bytes the caller has already read; with stat_only, a new or changed input is not read here at all
+        # and comes back as (False, None), to be checked again where its bytes are read
+        stat = os.stat(input_path)
+        row = self.entries.get(output_path)
+
+        # Size/mtime fast path: an input that has not been touched is never re-read or re-hashed
+        if row and row[0] == input_path and row[1:3] == (stat.st_size, stat.st_mtime_ns):
+            input_hash = row[3]
+        elif input_hash is None:
+            if stat_only:
+                return False, None
+            input_hash = self.hash_file(input_path)
+
+        entry = (input_path, stat.st_size, stat.st_mtime_ns, input_hash, self.get_key(input_hash))
+        if not row or row[4] != entry[4]:
+            return False, entry
+
+        try:
+            output_stat = os.stat(output_path)
+        except FileNotFoundError:
+            return False, entry
+        if row[5:7] != (output_stat.st_size, output_stat.st_mtime_ns):
+            return False, entry
+
+        if row[1:3] != entry[1:3]:
+            # Touched but identical content: remember the new stat so the next run takes the fast path again
+            self.record(output_path, entry)
+        metrics.count("output_cache_hits")
+        return True, entry
+
+    def record(self, output_path, entry):
+        output_stat = os.stat(output_path)
+        row = (*entry, output_stat.st_size, output_stat.st_mtime_ns)
+        with self.lock:
+            self.entries[output_path] = row
+            self.pending.append((output_path, *row))
+            if len(self.pending) >= self.flush_every:
+                self.flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self):
+        # One transaction per batch of records: a crash loses at most the unflushed outputs, which just re-render
+        if not self.pending:
+            return
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,119 @@
+import threading
+
+from PIL import ImageTk
+
+from core.layer_compositor import LayerCompositor
+
+
+class PreviewRenderer:
+    def __init__(self, canvas, canvas_image, renderer):
+        self.canvas = canvas
+        self.canvas_image = canvas_image
+        self.renderer = renderer
+        self.compositor = LayerCompositor(renderer)
+        # render() may run on a worker thread; this keeps set_image from swapping the base under it
+        self.lock = threading.Lock()
+
+        self.base = None
+        self.photo = None
+
+        # Zoom: level None shows the fitted preview, otherwise a preview-sized window at origin onto a pyramid level.
+        # level/origin are what the UI asked for, view is what the compositor currently holds
+        self.pyramid = None
+        self.level = None
+        self.origin = (0, 0)
+        self.view = None
+
+    def set_image(self, preview_image, pyramid=None):
+        # Convert once per upload; every later repaint only restores and recomposites dirty rectangles
+        with self.lock:
+            self.compositor.set_base(preview_image, "RGBA")
+            self.base = self.compositor.base
+            self.pyramid = pyramid
+            self.level = None
+            self.origin = (0, 0)
+            self.view = self.get_view()
+
+        self.photo = ImageTk.PhotoImage(self.base)
+        self.canvas.itemconfig(self.canvas_image, image=self.photo)
+
+    def get_view(self):
+        return self.level, self.origin
+
+    def get_scale(self):
+        # Displayed pixels per preview pixel
+        if self.level is None:
+            return 1.0
+        return self.pyramid.get_level_size(self.level)[0] / self.base.width
+
+    def to_preview(self, x, y):
+        # Layers are edited in preview coordinates whatever the zoom, so canvas events are mapped back first
+        scale = self.get_scale()
+        return (x + self.origin[0]) / scale, (y + self.origin[1]) / scale
+
+    def zoom(self, steps, x, y):
+        # Steps through the pyramid levels larger than the preview, keeping the point under (x, y) in place
+        if self.pyramid is None:
+            return
+
+        levels = [None, *self.pyramid.get_levels(self.base.size)]
+        level = levels[min(max(levels.index(self.level) + steps, 0), len(levels) - 1)]
+        if level == self.level:
+            return
+
+        point_x, point_y = self.to_preview(x, y)
+        self.level = level
+        scale = self.get_scale()
+        self.set_origin(point_x * scale - x, point_y * scale - y)
+
+    def pan(self, dx, dy):
+        if self.level is not None:
+            self.set_origin(self.origin[0] - dx, self.origin[1] - dy)
+
+    def set_origin(self, x, y):
+        if self.level is None:
+            origin = (0, 0)
+        else:
+            width, height = self.pyramid.get_level_size(self.level)
+            origin = (round(min(max(x, 0), width - self.base.width)), round(min(max(y, 0), height - self.base.height)))
+        self.origin = origin
+
+    def set_view(self, view):
+        level, origin = self.view = view
+        if level is None:
+            self.compositor.set_base(self.base, "RGBA")
+            return
+
+        # Only the tiles under the window are decoded and composited; Tk never sees more than the preview size
+        width, height = self.pyramid.get_level_size(level)
+        box = (*origin, origin[0] + self.base.width, origin[1] + self.base.height)
+        self.compositor.set_base(self.pyramid.get_region(level, box), "RGBA", canvas_size=(width, height),
+                                 origin=origin)
+
+    def render(self, layers, view):
+        # All Pillow work happens here and is safe off the Tk thread; returns the patches for present()
+        with self.lock:
+            if self.base is None:
+                return []
+
+            if view != self.view:
+                # A new window has no previous composite to diff against, so it is drawn and pushed whole
+                self.set_view(view)
+                self.compositor.render(layers)
+                return [(None, self.compositor.image.copy())]
+
+            return [(rect, self.compositor.image.crop(rect)) for rect in self.compositor.render(layers)]
+
+    def present(self, patches):
+        # Tk thread only
+        for rect, region in patches:
+            if rect is None:
+                self.photo.paste(region)
+            else:
+                self.blit(region, rect)
+
+    def blit(self, region, rect):
+        # Copy only the dirty rectangle into the displayed Tk photo instead of rebuilding it
+        patch = ImageTk.PhotoImage(region)
+        self.canvas.tk.call(str(self.photo), "copy", str(patch), "-to", rect[0], rect[1],
+                            "-compositingrule", "set")
@@ -0,0 +1,79 @@
+import logging
+import threading
+
+from config import config
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RenderScheduler:
+    def __init__(self, widget, render, deliver, poll_interval=config.PREVIEW_FRAME_INTERVAL_MS):
+        # render runs on a worker thread; deliver runs on the Tk thread through widget.after polling
+        self.widget = widget
+        self.render = render
+        self.deliver = deliver
+        self.poll_interval = poll_interval
+
+        self.condition = threading.Condition()
+        # Only the newest request waits; submitting again replaces it, so bursts of events cost one render
+        self.request = None
+        self.results = []
+        self.epoch = 0
+        self.busy = False
+        self.polling = False
+
+        self.thread = threading.Thread(target=self.run, name="preview-render", daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        with self.condition:
+            if self.request is not None:
+                metrics.count("preview_renders_skipped")
+            self.request = self.epoch, request
+            self.condition.notify()
+        self.schedule_poll()
+
+    def cancel(self):
+        # Drops the pending request and any undelivered results, e.g. when a different image is loaded
+        with self.condition:
+            self.epoch += 1
+            self.request = None
+            self.results = []
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.request is None:
+                    self.condition.wait()
+                (epoch, request), self.request = self.request, None
+                self.busy = True
+
+            try:
+                result = self.render(request)
+            except Exception:
+                logger.exception("Preview render failed")
+                result = None
+
+            with self.condition:
+                self.busy = False
+                # Finished results are never skipped: each one's dirty rectangles build on the previous one's
+                if result is not None and epoch == self.epoch:
+                    self.results.append(result)
+
+    def schedule_poll(self):
+        if not self.polling:
+            self.polling = True
+            self.widget.after(self.poll_interval, self.poll)
+
+    def poll(self):
+        with self.condition:
+            results, self.results = self.results, []
+            pending = self.busy or self.request is not None
+
+        for result in results:
+            self.deliver(result)
+
+        self.polling = False
+        if pending:
+            self.schedule_poll()
@@ -0,0 +1,231 @@
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from config import config
+from core.batch_processor import _init_worker, _render_upload, _warm_up
+from core.logo_cache import LogoCache
+from core.metrics import metrics
+from core.watermark_spec import WatermarkSpec
+
+logger = logging.getLogger(__name__)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    server_version = "WatermarkServer/1.0"
+    # Keep-alive, so clients can reuse one connection for many renders
+    protocol_version = "HTTP/1.1"
+    content_types = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+    chunk_size = 256 * 1024
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # Large results go out in chunks rather than as one giant socket write
+        view = memoryview(body)
+        for offset in range(0, len(body), self.chunk_size):
+            self.wfile.write(view[offset:offset + self.chunk_size])
+
+    def send_failure(self, status, message, close=False, headers=None):
+        metrics.count(f"http_{status.value}")
+        if close:
+            # The request body was not read, so the connection cannot be reused
+            self.close_connection = True
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        body = json.dumps({"error": message}).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if close:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self.send_body(HTTPStatus.OK, json.dumps(self.server.get_health()).encode(), "application/json")
+        elif path == "/metrics":
+            if parse_qs(urlsplit(self.path).query).get("format") == ["json"]:
+                self.send_body(HTTPStatus.OK, metrics.to_json().encode(), "application/json")
+            else:
+                self.send_body(HTTPStatus.OK, metrics.to_prometheus().encode(), "text/plain; version=0.0.4")
+        else:
+            self.send_failure(HTTPStatus.NOT_FOUND, f"No route for {path}.")
+
+    def do_POST(self):
+        # Whatever goes wrong while rendering (a broken worker pool, a bug), the client still gets a response
+        try:
+            self.handle_render()
+        except ConnectionError:
+            self.close_connection = True
+        except Exception:
+            logger.exception("Request %s failed", self.path)
+            self.send_failure(HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error.", close=True)
+
+    def handle_render(self):
+        url = urlsplit(self.path)
+        if url.path != "/render":
+            self.send_failure(HTTPStatus.NOT_FOUND, f"No route for {url.path}.", close=True)
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_failure(HTTPStatus.BAD_REQUEST, "Invalid Content-Length.", close=True)
+            return
+        if not length:
+            self.send_failure(HTTPStatus.LENGTH_REQUIRED, "The image must be sent as the request body.", close=True)
+            return
+        if length > self.server.max_upload:
+            self.send_failure(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Image too large.", close=True)
+            return
+
+        fmt = parse_qs(url.query).get("format", [self.server.fmt])[0].upper()
+        if fmt not in self.content_types:
+            self.send_failure(HTTPStatus.BAD_REQUEST, f"Unsupported output format '{fmt}'.", close=True)
+            return
+
+        spec_json = self.headers.get("X-Watermark-Spec") or self.server.spec_json
+        try:
+            if spec_json is None:
+                raise ValueError("No watermark spec given (X-Watermark-Spec header).")
+            spec = WatermarkSpec.from_json(spec_json)
+            if self.headers.get("X-Watermark-Spec"):
+                # Clients only get to name logos in the assets image directory, never arbitrary files
+                for layer in spec.layers:
+                    if layer.get("type") == "image" and not LogoCache.is_asset(layer["source"]):
+                        raise ValueError(f"Image source '{layer['source']}' is not in the assets image directory.")
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_failure(HTTPStatus.BAD_REQUEST, f"Invalid watermark spec: {e}", close=True)
+            return
+
+        # The slot is taken before the body is read, so waiting requests never hold their uploads in memory
+        if not self.server.acquire_slot():
+            self.send_failure(HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, retry later.", close=True,
+                              headers={"Retry-After": "1"})
+            return
+
+        try:
+            with metrics.span("request"):
+                data = self.rfile.read(length)
+                encoded, error = self.server.render(data, spec_json, fmt)
+        finally:
+            self.server.release_slot()
+
+        if error:
+            self.send_failure(HTTPStatus.UNPROCESSABLE_ENTITY, error)
+            return
+        metrics.count("http_200")
+        self.send_body(HTTPStatus.OK, encoded, self.content_types[fmt])
+
+
+class RenderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=(config.SERVER_HOST, config.SERVER_PORT), spec=None, fmt=config.OUTPUT_FORMAT,
+                 workers=None, max_concurrent=None, blend_backend=None, queue_timeout=config.SERVER_QUEUE_TIMEOUT,
+                 max_upload_mb=config.SERVER_MAX_UPLOAD_MB):
+        super().__init__(address, RenderRequestHandler)
+        # Default spec for requests that do not send their own
+        self.spec_json = spec.to_json() if spec is not None else None
+        self.fmt = fmt.upper()
+        self.workers = workers or config.SERVER_WORKERS
+        self.max_concurrent = max_concurrent or config.SERVER_MAX_CONCURRENT
+        self.queue_timeout = queue_timeout
+        self.max_upload = max_upload_mb * 1024 * 1024
+        self.started = time.time()
+
+        self.slots = threading.BoundedSemaphore(self.max_concurrent)
+        self.active = 0
+        self.active_lock = threading.Lock()
+        self.blend_backend = blend_backend or config.BLEND_BACKEND
+        self.executor = self.start_executor()
+        self.executor_lock = threading.Lock()
+        self.pool_restarts = 0
+
+    def start_executor(self, mp_context=None):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                   initargs=(None, self.blend_backend, metrics.enabled), mp_context=mp_context)
+
+    def replace_executor(self, broken):
+        # A worker that dies abruptly (e.g. killed for memory) breaks the whole pool; the first request to notice
+        # replaces it, and the new workers are started right away rather than on the next request
+        with self.executor_lock:
+            if self.executor is not broken:
+                return
+            logger.error("Worker pool broke, starting a new one")
+            broken.shutdown(wait=False, cancel_futures=True)
+            # Handler threads are running, so the new workers are started by a fork server instead of forking
+            self.executor = self.start_executor(multiprocessing.get_context("forkserver"))
+            self.pool_restarts += 1
+            metrics.count("pool_restarts")
+            self.warm_up()
+
+    def is_pool_broken(self):
+        # ProcessPoolExecutor has no public flag for this
+        return bool(getattr(self.executor, "_broken", False))
+
+    def warm_up(self):
+        # Starts every worker now (fonts are preloaded in the initializer) instead of on the first requests
+        wait([self.executor.submit(_warm_up) for _ in range(self.workers)])
+
+    def acquire_slot(self):
+        # Requests beyond max_concurrent wait up to queue_timeout, then get a 503
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            return False
+        with self.active_lock:
+            self.active += 1
+        return True
+
+    def release_slot(self):
+        with self.active_lock:
+            self.active -= 1
+        self.slots.release()
+
+    def render(self, data, spec_json, fmt):
+        executor = self.executor
+        try:
+            future = executor.submit(_render_upload, data, spec_json, fmt)
+        except BrokenProcessPool:
+            # The pool broke before this request, which has not run yet, so it goes to the new one
+            self.replace_executor(executor)
+            executor = self.executor
+            future = executor.submit(_render_upload, data, spec_json, fmt)
+
+        try:
+            encoded, error, worker_metrics = future.result()
+        except BrokenProcessPool:
+            # This upload may be what killed the worker, so it fails instead of being retried
+            self.replace_executor(executor)
+            return None, "The worker rendering this image crashed."
+        if worker_metrics:
+            metrics.merge(worker_metrics)
+        return encoded, error
+
+    def get_health(self):
+        with self.active_lock:
+            active = self.active
+        # Degraded until the next render request replaces the broken pool
+        return {"status": "degraded" if self.is_pool_broken() else "ok", "workers": self.workers,
+                "active_requests": active, "max_concurrent": self.max_concurrent, "pool_restarts": self.pool_restarts,
+                "uptime_seconds": round(time.time() - self.started, 1)}
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,301 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from config import config
+from core.batch_processor import BatchProcessor, _describe_error, _watermark_file
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class InotifyWatcher:
+    # From <sys/inotify.h>: a finished write, a file renamed in, and queue overflow
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    event_header = struct.Struct("iIII")
+
+    def __init__(self, directory):
+        self.directory = directory
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        # IN_NONBLOCK and IN_CLOEXEC share their values with the O_ flags
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch '{directory}'")
+
+    def read(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset + self.event_header.size <= len(data):
+            _, mask, _, length = self.event_header.unpack_from(data, offset)
+            name = data[offset + self.event_header.size:offset + self.event_header.size + length].rstrip(b"\0")
+            offset += self.event_header.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost; a rescan finds whatever they were about
+                paths += [entry.path for entry in os.scandir(self.directory)]
+            elif name:
+                paths.append(os.path.join(self.directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    def __init__(self, directory, interval=config.WATCH_POLL_INTERVAL):
+        # For platforms without inotify and for network shares, where remote writes raise no local events
+        self.directory = directory
+        self.interval = interval
+        self.next_scan = 0.0
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            snapshot[entry.path] = stat.st_size, stat.st_mtime_ns
+        return snapshot
+
+    def read(self, timeout):
+        delay = self.next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+
+        time.sleep(max(0.0, delay))
+        self.next_scan = time.monotonic() + self.interval
+        snapshot = self.scan()
+        changed = [path for path, signature in snapshot.items() if self.snapshot.get(path) != signature]
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def get_watcher(directory, polling=False, interval=config.WATCH_POLL_INTERVAL):
+    if not polling:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            # AttributeError: the C library has no inotify (not Linux)
+            logger.info("inotify unavailable (%s), polling %s instead", e, directory)
+    return PollingWatcher(directory, interval)
+
+
+class PersistentQueue:
+    def __init__(self, path):
+        # A settled file is stored here until its job finishes, so a restart picks up where the last run stopped
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS queue (input_path TEXT PRIMARY KEY, added REAL)")
+        self.pending = OrderedDict(self.db.execute("SELECT input_path, added FROM queue ORDER BY added"))
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, path):
+        if path in self.pending:
+            return
+        self.pending[path] = time.time()
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO queue VALUES (?, ?)", (path, self.pending[path]))
+
+    def take(self):
+        # The row stays until done(); only the in-memory order moves on
+        return self.pending.popitem(last=False)[0] if self.pending else None
+
+    def done(self, path):
+        # A file re-queued while its previous job was running keeps its row
+        if path in self.pending:
+            return
+        with self.db:
+            self.db.execute("DELETE FROM queue WHERE input_path = ?", (path,))
+
+    def close(self):
+        self.db.close()
+
+
+class WatchDaemon(BatchProcessor):
+    def __init__(self, options, input_dir, output_dir, polling=False, settle_seconds=None, poll_interval=None,
+                 tick=0.05, **kwargs):
+        super().__init__(options, output_dir, **kwargs)
+        self.input_dir = os.path.abspath(input_dir)
+        self.input_root = self.input_dir
+        self.polling = polling
+        self.settle_seconds = config.WATCH_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+        self.poll_interval = poll_interval or config.WATCH_POLL_INTERVAL
+        self.tick = tick
+
+        # path -> (size/mtime signature, when it last changed, when it was first seen)
+        self.settling = {}
+        self.seen = {}
+        # future -> (input path, output path)
+        self.in_flight = {}
+        self.stopped = threading.Event()
+        self.stats = {"processed": 0, "skipped": 0, "failed": 0}
+
+    def stop(self):
+        self.stopped.set()
+
+    def is_input(self, path):
+        name = os.path.basename(path)
+        return not name.startswith(".") and name.lower().endswith(config.IMAGE_FORMATS)
+
+    def is_ambiguous(self, input_path):
+        # Files keep arriving, so the folder itself decides whether another input shares this stem
+        stem = Path(input_path).stem
+        siblings = (entry.path for entry in os.scandir(self.input_dir) if Path(entry.name).stem == stem)
+        return sum(map(self.is_input, siblings)) > 1
+
+    def watch(self, path, now):
+        if self.is_input(path):
+            self.seen.setdefault(path, now)
+            self.settling[path] = None, now
+
+    def settle(self, queue, now):
+        # A file is handed on only once its size and mtime have held still for settle_seconds,
+        # so copies that are still being written (or re-opened by the writer) are left alone
+        for path, (signature, since) in list(self.settling.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.settling[path]
+                self.seen.pop(path, None)
+                continue
+
+            current = stat.st_size, stat.st_mtime_ns
+            if current != signature:
+                self.settling[path] = current, now
+            elif now - since >= self.settle_seconds and stat.st_size:
+                del self.settling[path]
+                queue.put(path)
+
+    def submit(self, executor, queue):
+        # The pool never holds more than two jobs per worker; the rest wait in the persisted queue
+        while len(self.in_flight) < self.workers * 2:
+            input_path = queue.take()
+            if input_path is None:
+                return
+
+            output_path = self.get_output_path(input_path)
+            try:
+                fresh = False
+                if self.cache is not None:
+                    fresh, self.entries[output_path] = self.cache.check(input_path, output_path)
+            except OSError:
+                fresh = True
+            if fresh:
+                # Unchanged since its last output (e.g. a rescan or a touch), or gone
+                self.stats["skipped"] += 1
+                self.seen.pop(input_path, None)
+                queue.done(input_path)
+                continue
+
+            try:
+                future = executor.submit(_watermark_file, (input_path, output_path))
+            except BrokenProcessPool:
+                # Back in line for the pool that replaces this one
+                queue.put(input_path)
+                raise
+            self.in_flight[future] = input_path, output_path
+
+    def collect(self, queue, timeout=0):
+        done, _ = wait(self.in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            input_path, output_path = self.in_flight.pop(future)
+            try:
+                _, error, data = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. killed for memory); only this file fails, the daemon keeps going
+                error, data = _describe_error(e), None
+            self.collect_metrics(data)
+            if error:
+                logger.warning("Failed %s: %s", input_path, error)
+                self.stats["failed"] += 1
+                self.entries.pop(output_path, None)
+            else:
+                self.record_output(output_path)
+                self.stats["processed"] += 1
+                seen = self.seen.pop(input_path, None)
+                if seen is not None:
+                    logger.info("Watermarked %s %.3f s after it appeared", input_path, time.monotonic() - seen)
+                    if metrics.enabled:
+                        metrics.record("watch_latency", time.monotonic() - seen)
+            queue.done(input_path)
+
+        if done and self.cache is not None:
+            self.cache.flush()
+
+    def run(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = self.open_cache()
+        queue = PersistentQueue(str(self.output_dir / config.WATCH_QUEUE_FILE))
+        watcher = get_watcher(self.input_dir, self.polling, self.poll_interval)
+        logger.info("Watching %s into %s (%s, %d queued from the last run)", self.input_dir, self.output_dir,
+                    type(watcher).__name__, len(queue))
+
+        # Files that arrived while the daemon was down go through the same settle and cache checks
+        now = time.monotonic()
+        for path in self.collect_inputs(self.input_dir):
+            self.watch(path, now)
+
+        executor = self.start_executor()
+        try:
+            while not self.stopped.is_set():
+                timeout = 0 if self.in_flight else self.tick
+                for path in watcher.read(timeout):
+                    self.watch(path, time.monotonic())
+                self.settle(queue, time.monotonic())
+                try:
+                    self.submit(executor, queue)
+                except BrokenProcessPool:
+                    # A worker died abruptly (e.g. killed for memory), which fails every job in flight and the pool
+                    logger.error("Worker pool broke, starting a new one")
+                    while self.in_flight:
+                        self.collect(queue, None)
+                    executor.shutdown()
+                    executor = self.start_executor()
+                self.collect(queue, self.tick if self.in_flight else 0)
+
+            # Jobs already handed to the pool are finished; queued ones stay persisted for the next run
+            while self.in_flight:
+                self.collect(queue, None)
+        finally:
+            executor.shutdown()
+            watcher.close()
+            queue.close()
+            self.close_cache()
+
+        logger.info("Stopped watching %s: %s", self.input_dir, self.stats)
+        return self.stats
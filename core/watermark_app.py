@@ -1,13 +1,27 @@
+import copy
+import logging
 import os.path
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, StringVar
 
-from PIL import Image, ImageTk, ImageDraw
+from PIL import ImageDraw
 
 from config import config
+from core.image_loader import ImageLoader
+from core.image_pyramid import ImagePyramid
+from core.layer_compositor import LayerCompositor
+from core.layers import ImageLayer, TextLayer
+from core.preview_renderer import PreviewRenderer
+from core.render_scheduler import RenderScheduler
+from core.strip_watermarker import StripWatermarker
+from core.watermark_renderer import WatermarkRenderer
+from core.watermark_spec import WatermarkSpec, to_normalized
 from core.widgets_manager import WidgetsManager
 from utils import format_image_size
 
+logger = logging.getLogger(__name__)
+
 
 class WatermarkApplication:
     def __init__(self):
@@ -24,11 +38,14 @@ class WatermarkApplication:
         self.root.mainloop()
 
     def init_variables(self):
-        self.scale_factor = 1
         self.watermarked_image = None
-        self.tk_image = None
         self.preview_image = None
         self.original_image = None
+        # The draggable text is always the top layer; extra layers sit underneath it in insertion order
+        self.text_layer = None
+        self.layers = []
+        self.export = None
+        self.pan_start = None
 
     def setup_window(self):
         root = tk.Tk()
@@ -41,6 +58,9 @@ class WatermarkApplication:
         menubar = tk.Menu(self.root)
         menubar.add_command(label="Select File", command=self.frame_select_file)
         menubar.add_command(label="Save File", command=self.save)
+        menubar.add_command(label="Add Image Layer", command=self.add_image_layer)
+        menubar.add_command(label="Clear Layers", command=self.clear_layers)
+        menubar.add_command(label="Save Spec", command=self.save_spec)
         self.root.config(menu=menubar)
 
     def setup_widgets(self):
@@ -79,6 +99,14 @@ class WatermarkApplication:
         self.canvas.grid(row=0, column=0, padx=10, pady=10)
         self.canvas_image = self.canvas.create_image(0, 0, anchor=tk.NW)
 
+        # Wheel zooms into the full-resolution pyramid around the cursor; right or middle drag pans the zoomed view
+        self.canvas.bind("<MouseWheel>", lambda event: self.zoom_preview(1 if event.delta > 0 else -1, event))
+        self.canvas.bind("<Button-4>", lambda event: self.zoom_preview(1, event))
+        self.canvas.bind("<Button-5>", lambda event: self.zoom_preview(-1, event))
+        for button in (2, 3):
+            self.canvas.bind(f"<ButtonPress-{button}>", self.start_pan)
+            self.canvas.bind(f"<B{button}-Motion>", self.pan_preview)
+
         self.image_heading = tk.Label(self.canvas_frame, text="Image Name and size", bg=config.BACKGROUND_COLOR_2)
         self.image_heading.grid(row=1, column=0, sticky="sew", pady=10)
 
@@ -95,7 +123,15 @@ class WatermarkApplication:
         self.font_color = StringVar()
         self.widgets = WidgetsManager(self.widgets_frame, self.canvas, self.update_watermark,
                                       canvas_image=self.canvas_image,
+                                      to_preview=lambda x, y: self.preview.to_preview(x, y),
                                       text=self.text, opacity=self.opacity, font_color=self.font_color)
+        self.renderer = WatermarkRenderer(self.widgets.fonts_manager)
+        self.preview = PreviewRenderer(self.canvas, self.canvas_image, self.renderer)
+        # Compositing runs on a worker thread; only finished patches are pushed to the canvas on the Tk thread
+        self.render_scheduler = RenderScheduler(self.root, lambda request: self.preview.render(*request),
+                                                self.preview.present)
+        self.loader = ImageLoader()
+        self.streamer = StripWatermarker(self.renderer, self.loader)
 
     def show_upload_frame(self):
         self.select_file_frame.grid(row=0, column=0, sticky="nsew")
@@ -119,22 +155,27 @@ class WatermarkApplication:
             return
 
         try:
-            self.original_image = Image.open(file_path)
+            self.original_image = self.loader.open(file_path)
+            self.preview_image = self.loader.load_preview(file_path, config.THUMBNAIL_SIZE)
+            pyramid = ImagePyramid(file_path, self.loader)
         except IOError:
             # TODO: Style the messagebox to display errors in a better way
             messagebox.showinfo("Error", message=f"Cannot open file {file_path}")
             self.frame_select_file()
             return
 
-        self.preview_image = self.original_image.copy()
-        self.preview_image.thumbnail(config.THUMBNAIL_SIZE)
-        self.tk_image = ImageTk.PhotoImage(self.preview_image)
+        original_size = self.loader.orient_size(self.original_image, self.original_image.size)
+        logger.info("Opened %s (%s, preview %s)", file_path, format_image_size(original_size),
+                    format_image_size(self.preview_image.size))
+        self.layers = []
+        self.export = None
+        self.render_scheduler.cancel()
+        self.preview.set_image(self.preview_image, pyramid)
+        self.widgets.update_image_draw(ImageDraw.Draw(self.preview.base))
         self.canvas.config(width=self.preview_image.width, height=self.preview_image.height)
-        self.canvas.itemconfig(self.canvas_image, image=self.tk_image)
 
-        self.scale_factor = self.original_image.width / self.preview_image.width
         self.image_heading.config(
-            text=f"Selected File: {file_path}\nOriginal Image Size: {format_image_size(self.original_image.size)} "
+            text=f"Selected File: {file_path}\nOriginal Image Size: {format_image_size(original_size)} "
                  f"| Resized Image Size: {format_image_size(self.preview_image.size)}")
 
         self.select_file_frame.grid_forget()
@@ -144,46 +185,95 @@ class WatermarkApplication:
 
     def save(self):
         if not self.original_image:
-            messagebox.showinfo("Error", message=f"Please select a file first")
+            messagebox.showinfo("Error", message="Please select a file first")
             self.frame_select_file()
             return
 
-        file_path = filedialog.asksaveasfilename(defaultextension=".png",
+        file_path = filedialog.asksaveasfilename(defaultextension=self.renderer.encoder.get_extension(),
                                                  filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"),
-                                                            ("All Files", "*.*")])
+                                                            ("WebP files", "*.webp"), ("All Files", "*.*")])
         if file_path:
-            watermark = Image.new("RGBA", self.original_image.size, (0, 0, 0, 0))
-            draw = ImageDraw.Draw(watermark)
-            self.widgets.update_image_draw(draw)
+            start = time.perf_counter()
+            layers = self.get_layers()
+            if len(layers) == 1 and self.streamer.can_stream(self.original_image.filename, file_path):
+                # Huge uncompressed sources are never fully decoded; the streamer reads them strip by strip
+                self.streamer.render_file(self.original_image.filename, file_path, self.get_spec())
+            else:
+                # The full-resolution composite is kept between saves, so a re-save only redoes changed layers
+                if self.export is None:
+                    self.export = LayerCompositor(self.renderer)
+                    # The decoded original is only ever read, so it serves as the base without another full copy
+                    self.export.set_base(self.renderer.decode(self.original_image), copy=False)
+                self.export.render(layers)
+                self.renderer.encoder.save(self.export.image, file_path)
+
+            logger.info("Image saved as %s in %.3f s", file_path, time.perf_counter() - start)
+
+    def zoom_preview(self, steps, event):
+        if self.preview_image:
+            self.preview.zoom(steps, event.x, event.y)
+            self.widgets.schedule_update()
+
+    def start_pan(self, event):
+        self.pan_start = event.x, event.y
+
+    def pan_preview(self, event):
+        if self.pan_start and self.preview_image:
+            self.preview.pan(event.x - self.pan_start[0], event.y - self.pan_start[1])
+            self.pan_start = event.x, event.y
+            self.widgets.schedule_update()
+
+    def add_image_layer(self):
+        if not self.original_image:
+            messagebox.showinfo("Error", message="Please select a file first")
+            return
 
-            options = self.get_selected_options()
-            scaled_x, scaled_y = int(options["x"] * self.scale_factor), int(
-                options["y"] * self.scale_factor)
+        file_path = filedialog.askopenfilename(filetypes=[("PNG files", "*.png"), ("All Files", "*.*")])
+        if not file_path:
+            return
 
-            scaled_font_size = int(options["font_size"] * self.scale_factor)
-            font = self.widgets.fonts_manager.get_font(options["font_name"], scaled_font_size, options["font_style"])
+        try:
+            # Loaded through the renderer's logo cache, which keeps the scaled copies for preview and export
+            layer_image = self.renderer.logos.load(file_path)
+        except IOError:
+            messagebox.showinfo("Error", message=f"Cannot open file {file_path}")
+            return
 
-            draw.text((scaled_x, scaled_y), options["text"], font=font, fill=options["color"],
-                      anchor=config.TEXT_ANCHOR)
+        # Logos start at their natural preview size, at most a quarter of the shorter side
+        reference = min(self.preview_image.size)
+        height = min(layer_image.height, reference // 4) / reference
+        self.layers.append(ImageLayer(layer_image, height, source=file_path, position="top-left"))
+        self.update_watermark()
 
-            watermarked = Image.alpha_composite(self.original_image.convert("RGBA"), watermark)
-            watermarked.convert("RGB").save(file_path, "PNG")
+    def clear_layers(self):
+        self.layers = []
+        self.update_watermark()
 
-            print(f"Image saved as {file_path}")
+    def save_spec(self):
+        if not self.original_image:
+            messagebox.showinfo("Error", message="Please select a file first")
+            return
 
-    def update_watermark(self, event=None):
-        options = self.get_selected_options()
-        x, y, text, color, font = options["x"], options["y"], options["text"], options["color"], options["font"]
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Watermark spec", "*.json")])
+        if file_path:
+            self.get_spec().save(file_path)
 
-        watermark_overlay = Image.new("RGBA", self.preview_image.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(watermark_overlay)
-        self.widgets.update_image_draw(draw)
+    def get_layers(self):
+        return [*self.layers, self.text_layer]
 
-        draw.text((x, y), text, font=font, fill=color, anchor=config.TEXT_ANCHOR)
+    def get_spec(self):
+        return WatermarkSpec.from_layers(self.get_layers())
 
-        watermarked_image = Image.alpha_composite(self.preview_image.convert("RGBA"), watermark_overlay)
-        self.tk_image = ImageTk.PhotoImage(watermarked_image)
-        self.canvas.itemconfig(self.canvas_image, image=self.tk_image)
+    def update_watermark(self, event=None):
+        # Widgets work in preview pixels; layers keep normalized geometry so preview and export share one layout
+        options = to_normalized(self.get_selected_options(), self.preview_image.size)
+        if self.text_layer is None:
+            self.text_layer = TextLayer.from_options(options)
+        else:
+            self.text_layer.update_from_options(options)
+        # The worker gets its own copies, so later edits on this thread never change a render in progress
+        layers = [copy.copy(layer) for layer in self.get_layers()]
+        self.render_scheduler.submit((layers, self.preview.get_view()))
         self.show_watermark_frame()
 
     def get_selected_options(self):
@@ -193,6 +283,7 @@ class WatermarkApplication:
         rgb = tuple(map(int, self.font_color.get().strip("()").split(
             ","))) if self.font_color.get() else config.DEFAULT_FONT_COLOR_RGB
         color_with_opacity = (rgb[0], rgb[1], rgb[2], opacity)
+        pattern = self.widgets.pattern_input.get()
 
         return {
             "x": x,
@@ -203,4 +294,8 @@ class WatermarkApplication:
             "font_name": font_style["name"],
             "font_size": font_style["size"],
             "font_style": font_style["style"],
+            # The dragged text is the pattern's grid origin when tiling
+            "position": WatermarkRenderer.pattern if pattern else None,
+            "rotation": config.PATTERN_ANGLE if pattern else 0,
+            "spacing": config.PATTERN_SPACING,
         }
@@ -0,0 +1,182 @@
+import json
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageOps
+
+from config import config
+from core.blend_backends import get_blender
+from core.fonts_manager import FontsManager
+from core.image_encoder import ImageEncoder
+from core.logo_cache import LogoCache
+from core.metrics import metrics
+from core.watermark_spec import PATTERN, POSITIONS, WatermarkSpec
+from core.watermark_stamp import WatermarkStamp
+from utils import get_preview_size
+
+
+class WatermarkRenderer:
+    positions = POSITIONS
+    pattern = PATTERN
+
+    def __init__(self, fonts_manager=None, encoder=None, blend_backend=config.BLEND_BACKEND, logos=None):
+        self.fonts_manager = fonts_manager or FontsManager()
+        self.logos = logos or LogoCache()
+        self.encoder = encoder or ImageEncoder()
+        self.blender = get_blender(blend_backend)
+        self.stamps = OrderedDict()
+
+    def set_blend_backend(self, name):
+        # Cached stamp tiles are stored in the previous backend's preferred layout
+        self.blender = get_blender(name)
+        self.stamps.clear()
+
+    def get_scale_factor(self, size):
+        # Options are expressed in preview coordinates, exactly as the GUI produces them
+        return size[0] / get_preview_size(size, config.THUMBNAIL_SIZE)[0]
+
+    def get_font(self, options, scale_factor=1):
+        font_size = max(1, int(options["font_size"] * scale_factor))
+        return self.fonts_manager.get_font(options["font_name"], font_size, options.get("font_style", "normal"),
+                                           options.get("font_weight"), options.get("font_width"))
+
+    def get_text_position(self, image_size, options, bbox, scale_factor=1):
+        # bbox is the text's extent relative to its anchor point, as returned by font.getbbox
+        position = options.get("position")
+        if not position:
+            return int(options["x"] * scale_factor), int(options["y"] * scale_factor)
+
+        if position not in self.positions:
+            raise ValueError(f"Unknown watermark position '{position}'.")
+
+        left, top, right, bottom = bbox
+        margin = int(options.get("margin", config.WATERMARK_MARGIN) * scale_factor)
+        free_x = image_size[0] - (right - left)
+        free_y = image_size[1] - (bottom - top)
+
+        x = free_x // 2 if position == "center" else free_x - margin if "right" in position else margin
+        y = free_y // 2 if position == "center" else free_y - margin if "bottom" in position else margin
+        return x - left, y - top
+
+    def get_tile_positions(self, image_size, options, tile, offset, scale_factor=1):
+        # Top-left corners at which the tile is composited; offset is the tile's corner relative to its anchor
+        offset_x, offset_y = offset
+        x, y = int(options.get("x", 0) * scale_factor), int(options.get("y", 0) * scale_factor)
+        if options.get("position") == self.pattern:
+            spacing = int(options.get("spacing", config.PATTERN_SPACING) * scale_factor)
+            return self.get_pattern_positions(image_size, tile.size, (x + offset_x, y + offset_y), spacing)
+
+        bbox = (offset_x, offset_y, offset_x + tile.width, offset_y + tile.height)
+        x, y = self.get_text_position(image_size, options, bbox, scale_factor)
+        return [(x + offset_x, y + offset_y)]
+
+    def get_pattern_positions(self, image_size, tile_size, origin, spacing):
+        # Grid through origin covering the image; odd rows shift half a step for the usual staggered look
+        if not tile_size[0] or not tile_size[1]:
+            return []
+
+        step_x, step_y = max(1, tile_size[0] + spacing), max(1, tile_size[1] + spacing)
+        positions = []
+        row = (-origin[1] - tile_size[1]) // step_y + 1
+        while origin[1] + row * step_y < image_size[1]:
+            row_x = origin[0] + (step_x // 2 if row % 2 else 0)
+            column = (-row_x - tile_size[0]) // step_x + 1
+            while row_x + column * step_x < image_size[0]:
+                positions.append((row_x + column * step_x, origin[1] + row * step_y))
+                column += 1
+            row += 1
+        return positions
+
+    def rotate_tile(self, tile, offset, angle):
+        # Rotate about the tile's centre so it pivots in place instead of around its anchor
+        if not angle % 360:
+            return tile, offset
+
+        rotated = tile.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True)
+        return rotated, (offset[0] + (tile.width - rotated.width) // 2, offset[1] + (tile.height - rotated.height) // 2)
+
+    def get_text_tile(self, text, font, color):
+        # Rasterize only the text bounding box; offset is the tile's corner relative to the anchor point
+        with metrics.span("text_layout"):
+            left, top, right, bottom = font.getbbox(text, anchor=config.TEXT_ANCHOR)
+            tile = Image.new("RGBA", (max(0, right - left), max(0, bottom - top)), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(tile)
+            draw.text((-left, -top), text, font=font, fill=tuple(color), anchor=config.TEXT_ANCHOR)
+        return tile, (left, top)
+
+    def composite_tile(self, base, tile, position, opacity=255, clip=None):
+        # Blend the tile into the base in place, clipped to the image (or clip box); other pixels are never touched
+        x, y = position
+        clip = clip or (0, 0, base.width, base.height)
+        left, top = max(clip[0], x), max(clip[1], y)
+        right, bottom = min(clip[2], x + tile.width), min(clip[3], y + tile.height)
+        if left >= right or top >= bottom:
+            return base
+
+        source = (left - x, top - y, right - x, bottom - y)
+        return self.blender.blend(base, tile, (left, top, right, bottom), source, opacity)
+
+    def draw_text(self, base, position, text, font, color):
+        tile, (offset_x, offset_y) = self.get_text_tile(text, font, color)
+        return self.composite_tile(base, tile, (position[0] + offset_x, position[1] + offset_y))
+
+    def get_render_mode(self, image):
+        return "RGBA" if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info else "RGB"
+
+    @staticmethod
+    def get_options_key(options):
+        # Stable serialization of a spec or legacy options; the live font object is not part of it
+        if isinstance(options, WatermarkSpec):
+            return options.key
+        return json.dumps({k: v for k, v in options.items() if k != "font"}, sort_keys=True)
+
+    def get_stamp(self, options):
+        # Reuse stamps across calls with the same spec so text is rasterized once per scale, not per image
+        key = self.get_options_key(options)
+        stamp = self.stamps.get(key)
+        metrics.count("stamp_cache_misses" if stamp is None else "stamp_cache_hits")
+        if stamp is None:
+            stamp = self.stamps[key] = WatermarkStamp(options, self)
+            if len(self.stamps) > config.STAMP_CACHE_SIZE:
+                self.stamps.popitem(last=False)
+        else:
+            self.stamps.move_to_end(key)
+        return stamp
+
+    def get_stamps(self, options, size, scale_factor=None):
+        # Options are a spec (laid out per target size) or legacy preview-relative options scaled by width
+        if isinstance(options, WatermarkSpec):
+            return [(self.get_stamp(layer), 1) for layer in options.get_layout(size)]
+        return [(self.get_stamp(options), scale_factor or self.get_scale_factor(size))]
+
+    def get_placements(self, options, size, scale_factor=None):
+        # Every (tile, top-left position, opacity) the options put on an image of this size, for callers that
+        # composite part of an image at a time
+        placements = []
+        for stamp, stamp_scale in self.get_stamps(options, size, scale_factor):
+            tile, _ = stamp.get_tile(stamp_scale)
+            placements += [(tile, position, stamp.get_opacity()) for position in stamp.get_positions(size, stamp_scale)]
+        return placements
+
+    def render(self, image, options, scale_factor=None, in_place=False):
+        # Sources without alpha stay RGB end to end; in_place skips the copy when the caller owns the image
+        mode = self.get_render_mode(image)
+        watermarked = image if in_place and image.mode == mode else image.convert(mode)
+        with metrics.span("composite"):
+            for stamp, stamp_scale in self.get_stamps(options, image.size, scale_factor):
+                stamp.apply(watermarked, stamp_scale)
+        return watermarked
+
+    def decode(self, image):
+        # Forces the pending decode of a lazily opened image, timed and counted. EXIF orientation is applied here,
+        # once, and dropped from the metadata so the saved output is not rotated a second time by viewers
+        with metrics.span("decode"):
+            image.load()
+            ImageOps.exif_transpose(image, in_place=True)
+        metrics.count("bytes_decoded", image.width * image.height * len(image.getbands()))
+        return image
+
+    def render_file(self, input_path, output_path, options, fmt=None):
+        with Image.open(input_path) as image:
+            self.decode(image)
+            watermarked = self.render(image, options, in_place=True)
+            return self.encoder.save(watermarked, output_path, fmt)
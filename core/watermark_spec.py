@@ -0,0 +1,160 @@
+import json
+import threading
+from collections import OrderedDict
+
+from config import config
+from core.metrics import metrics
+
+# Lengths are fractions of the image's shorter side; x/y are fractions of its width/height
+LENGTH_KEYS = ("font_size", "height", "margin", "spacing")
+SCALED_KEYS = ("font_size", "height")
+# Lengths a layer leaves unset; the pixel defaults are meant at preview size, so they scale with the image like the rest
+DEFAULT_LENGTHS = {"margin": config.WATERMARK_MARGIN / min(config.THUMBNAIL_SIZE),
+                   "spacing": config.PATTERN_SPACING / min(config.THUMBNAIL_SIZE)}
+
+POSITIONS = ("top-left", "top-right", "bottom-left", "bottom-right", "center")
+# Placement that repeats the watermark across the whole image instead of anchoring it once
+PATTERN = "tile"
+
+# What a spec read from JSON (a file, a request) may hold: numbers with their inclusive range (None leaves a side
+# open) and strings; color and position are checked on their own
+NUMBER_RANGES = {"x": (0, 1), "y": (0, 1), "font_size": (0, 1), "height": (0, 1), "margin": (0, 1), "spacing": (0, 1),
+                 "opacity": (0, 255), "rotation": (None, None), "scale": (0, None), "font_weight": (0, None),
+                 "font_width": (0, None)}
+STRING_KEYS = ("type", "text", "font_name", "font_style", "source")
+
+_layouts = OrderedDict()
+_layouts_lock = threading.Lock()
+
+
+def to_pixels(params, size):
+    # The one mapping from normalized to pixel geometry; round() keeps preview and export within half a pixel
+    width, height = size
+    reference = min(size)
+    pixels = {key: value for key, value in params.items() if key != "scale"}
+    pixels["x"] = round(params.get("x", 0) * width)
+    pixels["y"] = round(params.get("y", 0) * height)
+    for key in LENGTH_KEYS:
+        length = params[key] if params.get(key) is not None else DEFAULT_LENGTHS.get(key)
+        if length is not None:
+            value = length * reference * (params.get("scale", 1) if key in SCALED_KEYS else 1)
+            pixels[key] = max(1, round(value)) if key in SCALED_KEYS else round(value)
+    return pixels
+
+
+def to_normalized(params, size):
+    width, height = size
+    reference = min(size)
+    normalized = dict(params)
+    normalized["x"] = params.get("x", 0) / width
+    normalized["y"] = params.get("y", 0) / height
+    for key in LENGTH_KEYS:
+        if params.get(key) is not None:
+            normalized[key] = params[key] / reference
+    return normalized
+
+
+class WatermarkSpec:
+    version = 1
+    # Keys that only exist at runtime and are never serialized
+    runtime_keys = ("font", "image")
+    required_keys = {"text": ("text", "font_name", "font_size", "color"), "image": ("source", "height")}
+
+    def __init__(self, layers):
+        self.layers = [{key: list(value) if isinstance(value, tuple) else value for key, value in layer.items()
+                        if key not in self.runtime_keys} for layer in layers]
+        for layer in self.layers:
+            layer_type = layer.get("type", "text")
+            if layer_type not in self.required_keys:
+                raise ValueError(f"Unknown layer type '{layer_type}'.")
+            missing = [key for key in self.required_keys[layer_type] if key not in layer]
+            if missing:
+                raise ValueError(f"Spec {layer_type} layer is missing {', '.join(missing)}.")
+        self.key = json.dumps(self.layers, sort_keys=True)
+
+    @classmethod
+    def from_layers(cls, layers):
+        return cls([layer.to_spec() for layer in layers if layer.visible])
+
+    @classmethod
+    def from_options(cls, options, size):
+        # A single text layer from pixel options measured on an image of the given size (e.g. the preview)
+        return cls([dict(to_normalized(options, size), type="text")])
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("A watermark spec must be a JSON object.")
+        if data.get("version") != cls.version:
+            raise ValueError(f"Unsupported watermark spec version '{data.get('version')}'.")
+        layers = data.get("layers")
+        if not isinstance(layers, list) or not all(isinstance(layer, dict) for layer in layers):
+            raise ValueError("Watermark spec 'layers' must be a list of objects.")
+        spec = cls(layers)
+        cls.validate(spec.layers)
+        return spec
+
+    @staticmethod
+    def check_field(key, value):
+        # Returns what is wrong with one value of a JSON layer, or None
+        if key in NUMBER_RANGES:
+            low, high = NUMBER_RANGES[key]
+            if isinstance(value, bool) or not isinstance(value, int if key == "opacity" else (int, float)):
+                return "must be an integer" if key == "opacity" else "must be a number"
+            if (low is not None and value < low) or (high is not None and value > high):
+                return f"must be from {low} to {high}" if high is not None else f"must be at least {low}"
+        elif key in STRING_KEYS and not isinstance(value, str):
+            return "must be a string"
+        elif key == "color" and not (isinstance(value, list) and len(value) in (3, 4) and all(
+                isinstance(channel, int) and not isinstance(channel, bool) and 0 <= channel <= 255
+                for channel in value)):
+            return "must be a list of 3 or 4 integers from 0 to 255"
+        elif key == "position" and value not in (*POSITIONS, PATTERN):
+            return f"must be one of {', '.join((*POSITIONS, PATTERN))}"
+        return None
+
+    @classmethod
+    def validate(cls, layers):
+        # Specs from outside are checked field by field, so a bad value is reported by name with a 400 (or a CLI
+        # error) rather than failing deep inside the renderer; optional fields may be null
+        for index, layer in enumerate(layers, 1):
+            required = cls.required_keys.get(layer.get("type", "text"), ())
+            for key, value in layer.items():
+                if value is None and key not in required:
+                    continue
+                problem = cls.check_field(key, value)
+                if problem:
+                    raise ValueError(f"Layer {index} '{key}' {problem}, got {json.dumps(value)}.")
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fp:
+            return cls.from_json(fp.read())
+
+    def to_json(self):
+        return json.dumps({"version": self.version, "layers": self.layers}, indent=2)
+
+    def save(self, path):
+        with open(path, "w") as fp:
+            fp.write(self.to_json())
+        return path
+
+    def get_layout(self, size):
+        # Pixel geometry per layer for one target size, shared by every image (and process) of that size
+        key = (self.key, tuple(size))
+        with _layouts_lock:
+            layout = _layouts.get(key)
+            if layout is not None:
+                _layouts.move_to_end(key)
+                metrics.count("layout_cache_hits")
+                return layout
+
+        metrics.count("layout_cache_misses")
+
+        layout = tuple(to_pixels(layer, size) for layer in self.layers)
+        with _layouts_lock:
+            _layouts[key] = layout
+            if len(_layouts) > config.LAYOUT_CACHE_SIZE:
+                _layouts.popitem(last=False)
+        return layout
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+from config import config
+from core.metrics import metrics
+
+
+class WatermarkStamp:
+    def __init__(self, options, renderer, cache_mb=config.STAMP_CACHE_MB):
+        # The live font object is not part of the spec; tiles are rasterized from name/size/style per scale
+        self.options = {key: value for key, value in options.items() if key != "font"}
+        self.renderer = renderer
+
+        # Rasterized tiles keyed by scaled font size or logo height, least recently used first, bounded by pixel bytes
+        self.cache_bytes = cache_mb * 1024 * 1024
+        self.tiles = OrderedDict()
+        self.tiles_bytes = 0
+        self.tiles_lock = threading.Lock()
+
+    def is_logo(self):
+        return self.options.get("type", "text") == "image"
+
+    def get_font_size(self, scale_factor=1):
+        return max(1, int(self.options["font_size"] * scale_factor))
+
+    def get_logo_height(self, scale_factor=1):
+        return max(1, int(self.options["height"] * scale_factor))
+
+    def get_opacity(self):
+        # A logo's opacity is already in its cached alpha
+        return 255 if self.is_logo() else self.options.get("opacity", 255)
+
+    def rasterize(self, scale_factor=1):
+        if self.is_logo():
+            return self.renderer.logos.get_logo(self.options["source"], self.get_logo_height(scale_factor),
+                                                self.options.get("opacity", 255)), (0, 0)
+        font = self.renderer.get_font(self.options, scale_factor)
+        return self.renderer.get_text_tile(self.options["text"], font, self.options["color"])
+
+    def get_tile(self, scale_factor=1):
+        key = self.get_logo_height(scale_factor) if self.is_logo() else self.get_font_size(scale_factor)
+        with self.tiles_lock:
+            entry = self.tiles.get(key)
+            if entry is not None:
+                self.tiles.move_to_end(key)
+                metrics.count("tile_cache_hits")
+                return entry
+
+        metrics.count("tile_cache_misses")
+
+        tile, offset = self.rasterize(scale_factor)
+        tile, offset = self.renderer.rotate_tile(tile, offset, self.options.get("rotation", 0))
+        entry = self.renderer.blender.prepare_tile(tile), offset
+
+        with self.tiles_lock:
+            if key not in self.tiles:
+                self.tiles[key] = entry
+                self.tiles_bytes += entry[0].width * entry[0].height * 4
+            while self.tiles_bytes > self.cache_bytes and len(self.tiles) > 1:
+                tile, _ = self.tiles.popitem(last=False)[1]
+                self.tiles_bytes -= tile.width * tile.height * 4
+
+        return entry
+
+    def get_positions(self, size, scale_factor=1):
+        # Top-left corners of every copy of the tile on an image of the given size
+        tile, offset = self.get_tile(scale_factor)
+        return self.renderer.get_tile_positions(size, self.options, tile, offset, scale_factor)
+
+    def apply(self, image, scale_factor=1, position=None):
+        # position is the text anchor point in image pixels; by default it comes from the options
+        tile, (offset_x, offset_y) = self.get_tile(scale_factor)
+        if position is None:
+            positions = self.get_positions(image.size, scale_factor)
+        else:
+            positions = [(position[0] + offset_x, position[1] + offset_y)]
+
+        for tile_position in positions:
+            self.renderer.composite_tile(image, tile, tile_position, self.get_opacity())
+        return image
@@ -1,4 +1,5 @@
 import tkinter as tk
+from types import SimpleNamespace
 from tkinter import colorchooser
 from tkinter.constants import HORIZONTAL
 
@@ -13,12 +14,16 @@ class WidgetsManager:
         self.canvas = canvas
         self.update = update_func
         self.canvas_image = kwargs.get("canvas_image")
+        self.to_preview = kwargs.get("to_preview")
         self.font_color = kwargs.get("font_color")
         self.text = kwargs.get("text")
         self.draw = None
+        self.pending_update = None
 
         # Initialize Fonts
         self.fonts_manager = FontsManager()
+        if config.WARM_FONT_CACHE:
+            self.fonts_manager.warm_cache()
         self.fonts = self.fonts_manager.get_all_fonts()
         self.font_sizes = self.fonts_manager.font_sizes
 
@@ -57,6 +62,11 @@ class WidgetsManager:
             command=self.update, highlightthickness=0
         )
 
+        self.pattern_label = tk.Label(self.parent, text="Pattern", **label_kwargs)
+        self.pattern_input = tk.BooleanVar(self.parent, False)
+        self.pattern_button = tk.Checkbutton(self.parent, text="Repeat across image", variable=self.pattern_input,
+                                             command=self.update, highlightthickness=0)
+
         self.font_color_label = tk.Label(self.parent, text="Font Color", **label_kwargs)
         self.color_picker_button = tk.Button(self.parent, text="Pick Color", command=self.choose_color,
                                              highlightthickness=0)
@@ -80,7 +90,9 @@ class WidgetsManager:
             (self.font_style_label, self.font_style_buttons["normal"]),
             (None, self.font_style_buttons["bold"]),
             (None, self.font_style_buttons["italic"]),
+            (None, self.font_style_buttons["bold italic"]),
             (self.opacity_label, self.opacity_input),
+            (self.pattern_label, self.pattern_button),
             (self.font_color_label, self.color_picker_button),
             (None, self.font_color_display)
         ]
@@ -110,15 +122,13 @@ class WidgetsManager:
         self.text.trace_add("write", self.on_text_change)  # Listen for changes
 
     def create_font_style_buttons(self):
-        # TODO: Feature - Combine style of fonts - normal, bold, italic
-
         button_kwargs = {
             "variable": self.font_style_input, "indicatoron": False, "width": 10, "command": self.update,
             "highlightthickness": 0, "selectcolor": "#616161"
         }
 
-        return {style: tk.Radiobutton(self.parent, text=style.capitalize(), value=style, **button_kwargs)
-                for style in ["normal", "bold", "italic"]}
+        return {style: tk.Radiobutton(self.parent, text=style.title(), value=style, **button_kwargs)
+                for style in self.fonts_manager.get_available_styles()}
 
     def create_listbox(self, items, kwargs):
         listbox = tk.Listbox(self.parent, exportselection=0, height=3, **kwargs)
@@ -157,14 +167,30 @@ class WidgetsManager:
     def on_text_change(self, name, index, mode):
         self.draggable_text.set_text(self.text.get())
 
+    def map_event(self, event):
+        # The draggable text lives in preview coordinates, which differ from the canvas while zoomed
+        if self.to_preview is None:
+            return event
+        x, y = self.to_preview(event.x, event.y)
+        return SimpleNamespace(x=x, y=y)
+
     def on_drag_start(self, event):
         self.draggable_text.font = self.get_font_style()["font"]
-        self.draggable_text.on_drag_start(event, self.draw)
+        self.draggable_text.on_drag_start(self.map_event(event), self.draw)
 
     def on_drag_motion(self, event):
         if self.draggable_text.dragging:
-            self.draggable_text.on_drag_motion(event, self.draw)
-            self.update()
+            self.draggable_text.on_drag_motion(self.map_event(event), self.draw)
+            self.schedule_update()
+
+    def schedule_update(self):
+        # Coalesce bursts of motion events into at most one repaint per frame
+        if self.pending_update is None:
+            self.pending_update = self.canvas.after(config.PREVIEW_FRAME_INTERVAL_MS, self.flush_update)
+
+    def flush_update(self):
+        self.pending_update = None
+        self.update()
 
     def on_drag_end(self, event):
         self.draggable_text.on_drag_end(event)
@@ -181,6 +207,7 @@ class WidgetsManager:
         self.set_listbox_selection(self.font_input, self.fonts.index(config.DEFAULT_FONT))
         self.font_style_input.set(config.DEFAULT_FONT_STYLE)
         self.opacity_input.set(config.DEFAULT_OPACITY)
+        self.pattern_input.set(False)
         self.font_color.set(config.DEFAULT_FONT_COLOR_RGB)
         self.update_selected_color(config.DEFAULT_FONT_COLOR_HEX)
 
@@ -0,0 +1,45 @@
+import argparse
+
+from config import config
+from core.blend_backends import BLENDERS
+from core.metrics import metrics, setup_logging
+from core.render_server import RenderServer
+from core.watermark_spec import WatermarkSpec
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve watermark rendering over HTTP.")
+    parser.add_argument("--host", default=config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVER_PORT)
+    parser.add_argument("--spec", help="Default watermark spec JSON for requests without an X-Watermark-Spec header")
+    parser.add_argument("--format", default=config.OUTPUT_FORMAT, type=str.upper, choices=["PNG", "JPEG", "WEBP"],
+                        help="Default output format; a request can pick another with ?format=")
+    parser.add_argument("--backend", default=config.BLEND_BACKEND, choices=list(BLENDERS),
+                        help="Blend backend for compositing (numpy requires NumPy)")
+    parser.add_argument("--workers", type=int, default=config.SERVER_WORKERS, help="Worker processes")
+    parser.add_argument("--max-concurrent", type=int, default=config.SERVER_MAX_CONCURRENT,
+                        help="Requests rendering or waiting for a worker at once; more get 503")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    setup_logging()
+    # /metrics is part of the service, so collection is always on here
+    metrics.enabled = True
+
+    spec = WatermarkSpec.load(args.spec) if args.spec else None
+    server = RenderServer((args.host, args.port), spec=spec, fmt=args.format, workers=args.workers,
+                          max_concurrent=args.max_concurrent, blend_backend=args.backend)
+    server.warm_up()
+    print(f"Serving on http://{args.host}:{server.server_address[1]} with {server.workers} workers (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
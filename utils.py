@@ -1,2 +1,28 @@
+import math
+
+
 def format_image_size(size):
-    return f"{size[0]}x{size[1]}"
\ No newline at end of file
+    return f"{size[0]}x{size[1]}"
+
+
+def get_preview_size(size, thumbnail_size):
+    # Image.thumbnail's own arithmetic (Pillow's preserve_aspect_ratio): it only ever shrinks, fits the bound side
+    # exactly and rounds the other to whichever neighbouring integer keeps the aspect ratio closest
+    width, height = size
+    x, y = map(math.floor, thumbnail_size)
+    if x >= width and y >= height:
+        return width, height
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+    return x, y
+
+
+def parse_color(value):
+    return tuple(map(int, str(value).strip("()").split(",")))
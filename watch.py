@@ -0,0 +1,59 @@
+import argparse
+import signal
+
+from config import config
+from core.blend_backends import BLENDERS
+from core.metrics import metrics, setup_logging
+from core.watch_daemon import WatchDaemon
+from core.watermark_spec import WatermarkSpec
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Watermark every image that lands in a directory, until stopped.")
+    parser.add_argument("input", help="Directory to watch (not recursive)")
+    parser.add_argument("-o", "--output", required=True, help="Output directory")
+    parser.add_argument("--spec", required=True, help="Watermark spec JSON, e.g. saved from the GUI with 'Save Spec'")
+    parser.add_argument("--format", default=config.OUTPUT_FORMAT, type=str.upper, choices=["PNG", "JPEG", "WEBP"],
+                        help="Output format; encoder settings come from [ENCODER] in config.ini")
+    parser.add_argument("--backend", default=config.BLEND_BACKEND, choices=list(BLENDERS),
+                        help="Blend backend for compositing (numpy requires NumPy)")
+    parser.add_argument("--workers", type=int, default=config.BATCH_WORKERS, help="Worker processes")
+    parser.add_argument("--polling", action="store_true",
+                        help="Poll the directory instead of using inotify (needed for most network shares)")
+    parser.add_argument("--poll-interval", type=float, default=config.WATCH_POLL_INTERVAL, help="Seconds")
+    parser.add_argument("--settle", type=float, default=config.WATCH_SETTLE_SECONDS,
+                        help="Seconds a file's size and mtime must hold still before it is processed")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Re-render files even if their output is up to date in the output cache")
+    parser.add_argument("--jpeg-patch", action="store_true",
+                        help="JPEG to JPEG: re-encode only the blocks under the watermark (needs jpegtran with -drop, "
+                             "else re-encodes with the source's own quantization tables)")
+    parser.add_argument("--metrics", help="On exit, write timing spans and counters to this file")
+    parser.add_argument("--metrics-format", default="json", choices=["json", "prometheus"])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    setup_logging()
+    if args.metrics:
+        metrics.enabled = True
+
+    daemon = WatchDaemon(WatermarkSpec.load(args.spec), args.input, args.output, polling=args.polling,
+                         settle_seconds=args.settle, poll_interval=args.poll_interval, workers=args.workers,
+                         fmt=args.format, blend_backend=args.backend, use_cache=False if args.no_cache else None,
+                         jpeg_patch=args.jpeg_patch or None)
+
+    # Ctrl+C and service stops finish the running jobs; anything still queued is picked up on the next start
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: daemon.stop())
+
+    print(f"Watching {args.input} into {args.output} (Ctrl+C to stop)")
+    stats = daemon.run()
+    print(f"Watermarked {stats['processed']} images, skipped {stats['skipped']}, failed {stats['failed']}")
+    if args.metrics:
+        print(f"Metrics written to {metrics.dump(args.metrics, args.metrics_format)}")
+
+
+if __name__ == '__main__':
+    main()